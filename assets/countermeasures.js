@@ -0,0 +1,85 @@
+/*
+ * Client-side date switching for countermeasures_app.py
+ * (enabled with COUNTERMEASURES_CLIENTSIDE=1).
+ *
+ * The levels-store holds the int8 level matrix of each map trace, base64
+ * encoded with one row of regions per day, and the map of the newest date. It
+ * is decoded once per dataset and each date / colormap change only replaces
+ * the z arrays, colorscale and title of the figure already in the browser
+ * (the store's map when the dataset has just changed). In Animation mode the frames (z arrays and
+ * title only) are built here from the same matrix, with the play / slider
+ * controls sent in the store.
+ */
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    countermeasures: (function () {
+
+        var decoded = {store: null, traces: []};
+        var margin = null;
+
+        function decode(b64) {
+            var raw = atob(b64);
+            var levels = new Int8Array(raw.length);
+            for (var i = 0; i < raw.length; i++) {
+                levels[i] = raw.charCodeAt(i);
+            }
+            return levels;
+        }
+
+        function levels_on(store, day) {
+            return store.traces.map(function (trace, i) {
+                return Array.from(decoded.traces[i].subarray(day * trace.n, (day + 1) * trace.n));
+            });
+        }
+
+        function title_for(figure, date) {
+            return Object.assign({}, figure.layout.title, {text: 'Coronavirus counter-measures: ' + date});
+        }
+
+        function update_graph(value, colors, mode, store, figure) {
+
+            if (!store) {
+                return window.dash_clientside.no_update;
+            }
+            if (decoded.store !== store || !figure) {
+                decoded = {store: store, traces: store.traces.map(function (trace) { return decode(trace.levels); })};
+                figure = store.figure;
+                margin = figure.layout.margin;
+            }
+
+            var dates = Object.keys(store.date_index).sort(function (a, b) {
+                return store.date_index[a] - store.date_index[b];
+            });
+            var animate = mode === 'animate';
+            var date = animate || !(value in store.date_index) ? dates[dates.length - 1] : value;
+            var colorscale = store.colorscales[colors];
+            var z = levels_on(store, store.date_index[date]);
+
+            var data = figure.data.map(function (trace, i) {
+                return Object.assign({}, trace, {z: z[i], colorscale: colorscale});
+            });
+            if (!figure.layout.sliders) {
+                margin = figure.layout.margin;
+            }
+            var layout = Object.assign({}, figure.layout, {title: title_for(figure, date), margin: margin});
+            delete layout.updatemenus;
+            delete layout.sliders;
+            if (!animate) {
+                return {data: data, layout: layout};
+            }
+
+            var frames = dates.map(function (d) {
+                var frame_z = levels_on(store, store.date_index[d]);
+                return {
+                    name: d,
+                    traces: frame_z.map(function (z, i) { return i; }),
+                    data: frame_z.map(function (z) { return {z: z}; }),
+                    layout: {title: title_for(figure, d)}
+                };
+            });
+            return {data: data, layout: Object.assign(layout, store.controls), frames: frames};
+        }
+
+        return {update_graph: update_graph};
+    })()
+});
@@ -11,99 +11,528 @@
 #-----------------------------------------------------------------------
 
 import numpy as np
-import pandas as pd
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output, State
+from dash.dependencies import Input, Output, State, ClientsideFunction
+import plotly
 import plotly.graph_objects as go
-import plotly.express as px
-from flask import Flask
+import plotly.io as pio
+
+from flask import Flask, Response, request, abort, redirect, url_for, g
 import os
+import gzip
+import time
+import hashlib
+import json
+import base64
+from functools import partial
+from weakref import WeakSet
 from random import randint
 
+from countermeasures_data import current_dataset, publish_dataset, dataset_registry, default_source, start_refresher, load_population, Summary
+from countermeasures_figure import colormaps, level_colors, make_colorscale, map_figure, template_hash, title_text
+from countermeasures_rle import RunLengthStore
+from countermeasures_metrics import Histogram, Gauge, SlowRequestProfiler, render
+from countermeasures_precompute import DiskCache, start_precompute
+
+# Timing hooks exposed on /metrics (see Instrumentation below)
+stage_seconds = Histogram('countermeasures_stage_seconds', 'Time spent in each stage of building figures', ['stage'])
+background_seconds = Histogram('countermeasures_background_seconds', 'Time spent in each stage of refresh, prewarm and precompute work', ['stage'])
+callback_seconds = Histogram('countermeasures_callback_seconds', 'Latency of Dash callbacks', ['callback'])
+request_seconds = Histogram('countermeasures_http_request_seconds', 'Latency of HTTP requests', ['method', 'endpoint', 'status'])
+
+# Datasets
+"""
+The data is read by countermeasures_data on first use (current_dataset()),
+not at import. Further datasets listed in $COUNTERMEASURES_DATASETS are
+offered in a selector above the map. Each one is read when first selected,
+carries its own level legend and locationmode, and is kept in the
+memory-bounded LRU of dataset_registry(). Every cache below lives in the
+DerivedCache of its snapshot, so datasets never share entries, the budget
+counts them, and evicting or replacing a dataset drops its own entries only.
+"""
+
+# Hot reload of daily data
+"""
+current_dataset() is an immutable snapshot that is only ever replaced as a
+whole. With COUNTERMEASURES_REFRESH_INTERVAL=S (seconds) a background thread
+polls the data source and, when it has changed, parses the new table and
+publishes it in a single assignment: requests already running keep the
+snapshot they started with and new page loads pick up the new dates through
+serve_layout(), without restarting the worker.
+"""
+
+refresh_interval = float(os.environ.get('COUNTERMEASURES_REFRESH_INTERVAL', 0))
+
+# ========================================================================
+# Figure cache
+# ========================================================================
+
+"""
+Figures are keyed on (dataset snapshot, date, colormap): there are only
+len(datelist) x len(colormaps) of them, so each one is built once from the
+shared map_template() of countermeasures_figure and kept as serialized
+JSON in a bounded LRU of the snapshot's DerivedCache. Set
+COUNTERMEASURES_PREWARM=N to build the figures for the newest N dates at boot.
+
+With COUNTERMEASURES_PRECOMPUTE_DIR set, every map, animation and timeline
+is looked up in that shared on-disk cache (countermeasures_precompute.py)
+before being built, and each data refresh starts a background run that
+fills it for the new snapshot: one worker builds every date x colormap with
+COUNTERMEASURES_PRECOMPUTE_WORKERS threads (default 2), and the other
+workers read the results as they land. Video frames are only precomputed by
+the countermeasures_precompute.py command.
+
+Figures that outlive the process (the /figure URLs and their ETags) are
+versioned by figure_version(): the data version plus a hash of the rendered
+map templates and of the code laying out the animation and timeline, so a
+deploy that changes how figures look never serves the old ones.
+"""
+
+figure_cache_size = int(os.environ.get('COUNTERMEASURES_FIGURE_CACHE', 1024))
+prewarm = int(os.environ.get('COUNTERMEASURES_PREWARM', 0))
+precompute_dir = os.environ.get('COUNTERMEASURES_PRECOMPUTE_DIR')
+precompute_workers = int(os.environ.get('COUNTERMEASURES_PRECOMPUTE_WORKERS', 2))
+
+# This module builds the animation, timeline and drill-down layouts
+with open(__file__, 'rb') as f:
+    code_hash = hashlib.sha1(f.read() + plotly.__version__.encode('utf-8')).hexdigest()
+
 #-----------------------------------------------------------------------
-def discrete_colorscale(values, colors):
+def figure_version(snapshot):
     """
-    values - categorical values
-    colors - rgb or hex colorcodes for len(values)-1
-    returns - plotly  discrete colorscale, tickvals, ticktext
+    snapshot - Dataset
+    returns - version of the figures served for snapshot: its data version
+    plus a short hash of template_hash() and code_hash
     """
-    
-    if len(values) != len(colors)+1:
-        raise ValueError('len(values) should be = len(colors)+1')
-    values = sorted(values)     
-    nvalues = [(v-values[0])/(values[-1]-values[0]) for v in values]  #normalized values
-    colorscale = []
-    for k in range(len(colors)):
-        colorscale.extend([[nvalues[k], colors[k]], [nvalues[k+1], colors[k]]])        
-    tickvals = [((values[k]+values[k+1])/2.0) for k in range(len(values)-1)] 
-    ticktext = [f'{int(values[k])}' for k in range(len(values)-1)]
-    return colorscale, tickvals, ticktext
-#-----------------------------------------------------------------------
-
-# Define dictionary of counter-measures and deduce colorscale
-countermeasures = {
-'0': 'No or few containment measures in place',
-'1': 'Ban on public gatherings, cancellation of major events and conferences',
-'2': 'Schools and universities closed (dates matched to those from Unesco https://en.unesco.org/themes/education-emergencies/coronavirus-school-closures',
-'3': 'Non-essential shops, restaurants and bars closed',
-'4': 'Night curfew / partial lockdown in place for broad population categories',
-'5': 'All-day lockdown / shelter-in-place government instruction (citizens allowed to venture come out for essential items',
-#'6': 'Harsh lockdown (citizens forbidden to leave home even to buy essential items)'
-}
-nlabels = len(countermeasures)
-
-# Import Coronavirus countermeasure data from Olivier Lejeune
+
+    def build():
+        h = hashlib.sha1((template_hash(snapshot, stages=stage_seconds) + code_hash).encode('utf-8'))
+        return snapshot.version + '-' + h.hexdigest()[:8]
+
+    return snapshot.derived.get('figure_version', None, build, 1)
+#-----------------------------------------------------------------------
+
+disk_cache = DiskCache(precompute_dir, figure_version) if precompute_dir else None
+
+#-----------------------------------------------------------------------
+def cached_json(snapshot, kind, key, render, *args):
+    """
+    snapshot - Dataset
+    kind, key - entry in the on-disk cache
+    render - builder called with snapshot and args if the entry is not on disk
+    returns - serialized figure
+    """
+
+    if disk_cache is not None:
+        with stage_seconds.time(stage='disk'):
+            text = disk_cache.get(snapshot, kind, key)
+        if text is not None:
+            return text
+    return render(snapshot, *args)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def render_figure_json(snapshot, value, colors, stages=stage_seconds):
+    """
+    snapshot - Dataset
+    value - 'YYYY-MM-DD'
+    colors - name of a colormap in colormaps
+    stages - Histogram observing each stage (background_seconds outside requests)
+    returns - serialized map of snapshot on value
+    """
+
+    figure = map_figure(snapshot, value, colors, stages=stages)
+    with stages.time(stage='serialize'):
+        return json.dumps(figure, separators=(',', ':'))
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def build_figure_json(snapshot, value, colors, stages=stage_seconds):
+    """
+    snapshot - Dataset
+    value - 'YYYY-MM-DD'
+    colors - name of a colormap in colormaps
+    stages - Histogram observing each stage if the figure is built
+    returns - serialized map of snapshot on value, from the disk cache if it is there
+    """
+
+    return snapshot.derived.get('figure', (value, colors),
+        lambda: cached_json(snapshot, 'figure', colors + '/' + value, render_figure_json, value, colors, stages), figure_cache_size)
+#-----------------------------------------------------------------------
+
+loads_observed = WeakSet()
+
+#-----------------------------------------------------------------------
+def observe_load(snapshot, stages=stage_seconds):
+    """
+    snapshot - Dataset
+    stages - Histogram observing the load time of snapshot, once
+    """
+
+    if snapshot.load_seconds is not None and snapshot not in loads_observed:
+        loads_observed.add(snapshot)
+        stages.observe(snapshot.load_seconds, stage='load')
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def get_dataset(name=None):
+    """
+    name - dataset name (default: the current dataset)
+    returns - Dataset snapshot (raises KeyError for unknown names)
+    """
+
+    snapshot = dataset_registry().get(name)
+    observe_load(snapshot)
+    return snapshot
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def figure_json(value, colors, name=None):
+    """
+    value - 'YYYY-MM-DD' (the newest date if the dataset does not have it)
+    colors - name of a colormap in colormaps
+    name - dataset name (default: the current dataset)
+    returns - serialized figure for the dataset snapshot
+    """
+
+    snapshot = get_dataset(name)
+    if value not in snapshot.date_index:
+        value = snapshot.latest
+    return build_figure_json(snapshot, value, colors)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def prewarm_figures(snapshot, n):
+    """
+    snapshot - Dataset
+    n - number of newest dates to build for every colormap
+    """
+
+    for value in snapshot.datelist[::-1][:n]:
+        for colors in colormaps:
+            build_figure_json(snapshot, value, colors, background_seconds)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+@background_seconds.timed(stage='swap')
+def swap_dataset(snapshot):
+    """
+    snapshot - newly parsed Dataset
+    Publishes the new snapshot, drops the figures of the old one and warms
+    the cache again (and the on-disk cache in the background, if configured).
+    """
+
+    observe_load(snapshot, background_seconds)
+    old = publish_dataset(snapshot)
+    if old is not None:
+        old.derived.clear()
+    prewarm_figures(snapshot, prewarm)
+    if disk_cache is not None:
+        start_precompute(disk_cache, snapshot, precompute_tasks(snapshot), precompute_workers)
+    # old is None if no request had loaded the data yet
+    print('** dataset refreshed: ' + (old.latest if old is not None else 'not loaded') + ' --> ' + snapshot.latest)
+#-----------------------------------------------------------------------
+
+# ========================================================================
+# Timeline panel
+# ========================================================================
+
 """
-Daily updated Coronavirus containment measures taken by governments from 2020-01-23 to date
-Provided by Olivier Lejeune: http://www.olejeune.com/ at:
-https://github.com/OlivierLej/Coronavirus_CounterMeasures
-dataset.csv has structure: country_id, country_name, 20200123_date, ...  
+The timeline below the map shows, for every day, how many regions (or how
+many people, if COUNTERMEASURES_POPULATION is set) are at each level, with
+the peak of each level in the legend. It is read from the Summary cube of
+the snapshot, built once per data load, and each (group, measure, colormap)
+figure is serialized once.
 """
 
-url = r'https://raw.githubusercontent.com/OlivierLej/Coronavirus_CounterMeasures/master/dataset.csv'
-#url = r'https://raw.githubusercontent.com/patternizer/Coronavirus_CounterMeasures/master/dataset.csv'
-df = pd.read_csv(url)
-country_name = df.country_name
-country_id = df.country_id
+population = load_population()
+groups = {'all': 'All regions', 'usa': 'USA states', 'world': 'Countries'}
+
+#-----------------------------------------------------------------------
+def dataset_groups(snapshot):
+    """
+    snapshot - Dataset
+    returns - keys of groups that apply to snapshot (the usa / world split only
+    exists for datasets drawn with the 'auto' locationmode)
+    """
+
+    return list(groups) if snapshot.source.locationmode == 'auto' else ['all']
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def dataset_summary(snapshot):
+    """
+    snapshot - Dataset
+    returns - Summary cube of snapshot
+    """
+
+    return snapshot.derived.get('summary', None, lambda: Summary(snapshot, population), 1)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def build_timeline_json(snapshot, group, measure, colors):
+    """
+    snapshot - Dataset
+    group - key of groups
+    measure - 'counts' or 'population'
+    colors - name of a colormap in colormaps
+    returns - serialized render_timeline_json(), from the disk cache if it is there
+    """
+
+    return snapshot.derived.get('timeline', (group, measure, colors),
+        lambda: cached_json(snapshot, 'timeline', colors + '/' + group + '_' + measure, render_timeline_json, group, measure, colors), 64)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def render_timeline_json(snapshot, group, measure, colors):
+    """
+    snapshot - Dataset
+    group - key of groups
+    measure - 'counts' or 'population'
+    colors - name of a colormap in colormaps
+    returns - serialized stacked area figure of the daily level totals
+    """
+
+    summary = dataset_summary(snapshot)
+    nlevels = snapshot.source.nlevels
+    palette = level_colors(colors, nlevels)
+    totals = summary.series(group, measure)
+
+    data = []
+    for level, date, peak in summary.peak_dates(group, measure):
+        data.append(go.Scatter(
+            x = summary.datelist,
+            y = totals[:, level],
+            name = str(level) + (' (peak ' + date + ': ' + f'{peak:,.0f}' + ')' if peak > 0 else ''),
+            mode = 'lines',
+            line = dict(width=0.5, color=palette[min(level, nlevels-1)]),
+            stackgroup = 'levels',
+        ))
+
+    layout = go.Layout(
+        title = {'text': groups[group] + ': ' + ('population' if measure == 'population' else 'regions') + ' at each level', 'x': 0.46},
+        xaxis = dict(title='Date'),
+        yaxis = dict(title='Population' if measure == 'population' else 'Regions'),
+        legend = dict(title='Level'),
+        margin = dict(r=0, l=40, b=40, t=40),
+    )
+
+    return pio.to_json(go.Figure(data=data, layout=layout), validate=False)
+#-----------------------------------------------------------------------
+
+# ========================================================================
+# Region drill-down
+# ========================================================================
 
-# Import FIPS codes
 """
-USA data is at state level and uses the alpha-2 code FIPS convention.
-Country data uses the alpha-3 code FIPS convention.
-Extract alpha-2 codes for countries and re-populate dataframe country_id
+Clicking a region on the map shows its full level history and the dates on
+which its level changed. Both come from the RunLengthStore of the snapshot,
+built once per data load: the country_id --> row index and the run starts of
+each region make a lookup a dict access and a slice, without scanning the
+levels matrix.
 """
 
-fips = r'https://raw.githubusercontent.com/lukes/ISO-3166-Countries-with-Regional-Codes/master/all/all.csv'
-df_fips = pd.read_csv(fips)
-alpha_2_codes = df_fips['alpha-2']
-alpha_3_codes = df_fips['alpha-3']
-id_length = [len(country_id[i]) for i in range(0,len(country_id))]
-usa = [i for i in range(len(country_id)) if id_length[i] < 3]
-world = [i for i in range(len(country_id)) if id_length[i] > 2]
-   
-# Set date
-""" 
-Data is available from 2020-01-23 to 2020-07-30
-"""
-headers = df.columns
-for i in range(len(headers)-1):
+#-----------------------------------------------------------------------
+def run_lengths(snapshot):
+    """
+    snapshot - Dataset
+    returns - RunLengthStore of snapshot
+    """
+
+    return snapshot.derived.get('run_lengths', None, lambda: RunLengthStore(snapshot), 1)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def build_history_json(snapshot, region):
+    """
+    snapshot - Dataset
+    region - country_id
+    returns - serialized render_history_json()
+    """
+
+    return snapshot.derived.get('history', region, lambda: render_history_json(snapshot, region), 256)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def render_history_json(snapshot, region):
+    """
+    snapshot - Dataset
+    region - country_id
+    returns - serialized step chart of the level of region over time
+    """
+
+    store = run_lengths(snapshot)
+    transitions = store.transitions(region)
+    name = snapshot.country_name[store.row[region]]
+
+    data = [
     
-    if i>1:   
-        
-        columnstr = headers[i][0:4] + '-' + headers[i][4:6] + '-' + headers[i][6:8]
-        df.rename(columns = {headers[i]:columnstr}, inplace = True) 
-
-timenow = pd.Timestamp.now().to_pydatetime()
-timestr = timenow.strftime('%Y-%m-%d')
-date = str(timenow.year) + '-' + str("{:02}".format(timenow.month)) + '-' + str("{:02}".format(timenow.day))
-# Latest entry: 2020-07-31 --> nned to override timenow()
-date = '2020-07-30'
-country_status = df[date]
-datelist = df.columns[df.columns<=date]
-opts = [{'label' : i, 'value' : i} for i in datelist]
+    go.Scatter(
+            x = snapshot.datelist,
+            y = snapshot.levels[store.row[region]],
+            mode = 'lines',
+            line = dict(shape='hv', color='#0169b3'),
+            name = 'Level',
+            hoverinfo = 'x+y'),
+
+    go.Scatter(
+            x = [date for date, level in transitions],
+            y = [level for date, level in transitions],
+            mode = 'markers',
+            marker = dict(size=8, color='#a84190'),
+            name = 'Change',
+            hoverinfo = 'x+y')
+    ]
+
+    layout = go.Layout(
+        title = {'text': name + ' (' + region + ')', 'x': 0.46},
+        xaxis = dict(title='Date'),
+        yaxis = dict(title='Level', range=[-0.5, snapshot.source.nlevels + 0.5], dtick=1),
+        showlegend = False,
+        margin = dict(r=0, l=40, b=40, t=40),
+    )
+
+    return pio.to_json(go.Figure(data=data, layout=layout), validate=False)
+#-----------------------------------------------------------------------
+
+if prewarm > 0:
+    prewarm_figures(current_dataset(), prewarm)
+if refresh_interval > 0:
+    start_refresher(swap_dataset, refresh_interval)
+
+# ========================================================================
+# Client-side date switching
+# ========================================================================
+
+"""
+With COUNTERMEASURES_CLIENTSIDE=1 the page is sent, once per dataset, the
+map of the newest date together with the int8 level matrix (base64, one row
+of regions per day) and the colorscale of every colormap. Date and colormap
+changes are then handled in the browser by assets/countermeasures.js, which
+only swaps the z arrays and colorscale, so no request reaches the server.
+"""
+
+clientside = os.environ.get('COUNTERMEASURES_CLIENTSIDE', '0') == '1'
+
+#-----------------------------------------------------------------------
+def level_store(snapshot):
+    """
+    snapshot - Dataset
+    returns - render_level_store() of snapshot, built once
+    """
+
+    return snapshot.derived.get('level_store', None, lambda: render_level_store(snapshot), 1)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def render_level_store(snapshot):
+    """
+    snapshot - Dataset
+    returns - dict for dcc.Store holding the (days x regions) levels of each
+    map trace as base64 int8 bytes, the date --> row offset index, the
+    colorscale of each colormap and the map of the newest date
+    """
+
+    traces = []
+    for rows, locationmode in snapshot.traces():
+        levels = np.ascontiguousarray(snapshot.levels[rows].T)
+        traces.append({'n': len(rows), 'levels': base64.b64encode(levels.tobytes()).decode('ascii')})
+    return {
+        'date_index': snapshot.date_index,
+        'traces': traces,
+        'colorscales': {c: make_colorscale(c, snapshot.source.nlevels)[0] for c in colormaps},
+        'controls': animation_controls(snapshot.datelist),
+        'figure': json.loads(build_figure_json(snapshot, snapshot.latest, 'Shikari')),
+    }
+#-----------------------------------------------------------------------
+
+# ========================================================================
+# Animated timeline
+# ========================================================================
+
+"""
+In Animation mode the map is one figure with a frame per date and play /
+slider controls. Locations, text, colorscale and layout are sent once with
+the base traces; each frame carries only the z arrays of the traces and its
+title. The figure is built once per (snapshot, colormap) and
+kept serialized. With COUNTERMEASURES_CLIENTSIDE=1 the frames are built in the
+browser from the levels-store instead, using the same controls.
+"""
+
+#-----------------------------------------------------------------------
+def animation_controls(datelist):
+    """
+    datelist - list of 'YYYY-MM-DD'
+    returns - layout updatemenus (play / pause) and sliders (one step per date)
+    """
+
+    play = dict(frame=dict(duration=200, redraw=True), fromcurrent=True, transition=dict(duration=0))
+    pause = dict(frame=dict(duration=0, redraw=False), mode='immediate', transition=dict(duration=0))
+    step = dict(frame=dict(duration=0, redraw=True), mode='immediate', transition=dict(duration=0))
+    return {
+        'updatemenus': [dict(type='buttons', showactive=False, x=0.05, y=0, xanchor='right', yanchor='top', pad=dict(t=45, r=10),
+            buttons=[dict(label='Play', method='animate', args=[None, play]), dict(label='Pause', method='animate', args=[[None], pause])])],
+        'sliders': [dict(active=len(datelist)-1, x=0.05, y=0, len=0.9, pad=dict(t=30), currentvalue=dict(prefix='Date: '),
+            steps=[dict(label=d, method='animate', args=[[d], step]) for d in datelist])],
+        'margin': dict(r=0, l=0, b=120, t=40),
+    }
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def build_animation_json(snapshot, colors):
+    """
+    snapshot - Dataset
+    colors - name of a colormap in colormaps
+    returns - serialized render_animation_json(), from the disk cache if it is there
+    """
+
+    return snapshot.derived.get('animation', colors,
+        lambda: cached_json(snapshot, 'animation', colors, render_animation_json, colors), len(colormaps))
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def render_animation_json(snapshot, colors, stages=stage_seconds):
+    """
+    snapshot - Dataset
+    colors - name of a colormap in colormaps
+    stages - Histogram observing each stage (background_seconds outside requests)
+    returns - serialized map of the newest date with one z-only frame per date
+    """
+
+    figure = map_figure(snapshot, snapshot.latest, colors, stages=stages)
+    figure['layout'] = dict(figure['layout'], **animation_controls(snapshot.datelist))
+    title = figure['layout']['title']
+    levels = [snapshot.levels[rows].T.tolist() for rows, locationmode in snapshot.traces()]
+    figure['frames'] = [{
+        'name': date,
+        'traces': list(range(len(levels))),
+        'data': [{'z': trace[day]} for trace in levels],
+        'layout': {'title': dict(title, text=title_text(date))},
+    } for day, date in enumerate(snapshot.datelist)]
+    with stages.time(stage='serialize'):
+        return json.dumps(figure, separators=(',', ':'))
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def precompute_tasks(snapshot):
+    """
+    snapshot - Dataset
+    returns - list of countermeasures_precompute tasks building every map
+    (newest dates and the default colormap first), animation and timeline
+    of snapshot
+    """
+
+    palette = sorted(colormaps, key=lambda c: c != 'Shikari')
+    measures = ['counts'] + (['population'] if population else [])
+    tasks = [('figure', c + '/' + d, partial(render_figure_json, snapshot, d, c, background_seconds)) for d in snapshot.datelist[::-1] for c in palette]
+    tasks += [('animation', c, partial(render_animation_json, snapshot, c, background_seconds)) for c in palette]
+    tasks += [('timeline', c + '/' + g + '_' + m, partial(render_timeline_json, snapshot, g, m, c))
+              for c in palette for g in dataset_groups(snapshot) for m in measures]
+    return tasks
+#-----------------------------------------------------------------------
 
 # ========================================================================
 # Start the App
@@ -116,7 +545,114 @@ external_stylesheets = [dbc.themes.BOOTSTRAP]
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets, server=server)
 app.config.suppress_callback_exceptions = True
 
-app.layout = html.Div(children=[
+# ========================================================================
+# Instrumentation
+# ========================================================================
+
+"""
+Stage timings of figures built for requests (colorscale, traces, template,
+figure, serialize, disk, and the data load they waited for), per-callback
+and per-endpoint latency histograms and cache and dataset gauges are served
+in the Prometheus text format on /metrics (per worker process). Work done
+outside requests (dataset swap, prewarm, precompute and loads by the
+refresher) is timed in countermeasures_background_seconds instead.
+
+With COUNTERMEASURES_PROFILE_SLOW_MS=T every request runs under cProfile and
+requests slower than T ms leave a .prof dump in COUNTERMEASURES_PROFILE_DIR
+(default: profiles), e.g. for snakeviz or flameprof.
+"""
+
+profile_slow_ms = float(os.environ.get('COUNTERMEASURES_PROFILE_SLOW_MS', 0))
+profiler = SlowRequestProfiler(profile_slow_ms / 1000.0, os.environ.get('COUNTERMEASURES_PROFILE_DIR', 'profiles')) if profile_slow_ms > 0 else None
+
+#-----------------------------------------------------------------------
+def cache_stats():
+    """
+    returns - dict (cache, kind) --> hits, misses and entries of the caches
+    of every loaded snapshot
+    """
+
+    stats = {}
+    for snapshot in [current_dataset()] + list(dataset_registry().loaded.values()):
+        for name, counts in snapshot.derived.stats().items():
+            for kind, n in zip(('hits', 'misses', 'entries'), counts):
+                stats[(name, kind)] = stats.get((name, kind), 0) + n
+    return stats
+#-----------------------------------------------------------------------
+
+Gauge('countermeasures_cache', 'Figure cache hits, misses and entries', ['cache', 'kind'], cache_stats)
+Gauge('countermeasures_dataset_days', 'Days in the current dataset snapshot', ['version', 'latest'],
+      lambda: {(current_dataset().version, current_dataset().latest): len(current_dataset().datelist)})
+Gauge('countermeasures_dataset_regions', 'Regions in the current dataset snapshot', ['version'],
+      lambda: {(current_dataset().version,): len(current_dataset().country_id)})
+Gauge('countermeasures_dataset_load_seconds', 'Time taken to load the current dataset snapshot', ['version'],
+      lambda: {(current_dataset().version,): current_dataset().load_seconds or 0.0})
+Gauge('countermeasures_dataset_bytes', 'Memory held by the other loaded datasets', ['dataset'],
+      lambda: {(name,): dataset.nbytes for name, dataset in list(dataset_registry().loaded.items())})
+
+@server.route('/metrics')
+def metrics():
+    response = Response(render(), mimetype='text/plain')
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    response.cache_control.no_store = True
+    return response
+
+@server.before_request
+def start_request():
+
+    g.request_start = time.perf_counter()
+    if profiler is not None:
+        g.profile = profiler.start()
+
+@server.after_request
+def record_request(response):
+
+    endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+    if 'request_start' in g:
+        request_seconds.observe(time.perf_counter() - g.request_start, method=request.method, endpoint=endpoint, status=response.status_code)
+    if 'profile' in g:
+        body = request.get_json(silent=True) if request.is_json else None
+        name = endpoint + ('_' + body['output'] if isinstance(body, dict) and 'output' in body else '')
+        path = profiler.stop(g.profile, name)
+        if path:
+            print('** slow request profiled: ' + path)
+    return response
+
+#-----------------------------------------------------------------------
+def legend_children(source):
+    """
+    source - DatasetSource
+    returns - heading and one line per level of the legend beside the map
+    """
+
+    if source is default_source:
+        return [
+            html.H3(children='Intervention levels'),
+            html.Div(children='0 = No or few containment measures in place'),
+            html.Div(children='1 = Ban on public gatherings, cancellation of major events and conferences'),
+            html.Div(children=['2 = Schools and universities closed (dates matched to those from ', html.A('UNESCO', href='https://en.unesco.org/themes/education-emergencies/coronavirus-school-closures'), ')']),
+            html.Div(children='3 = Non-essential shops, restaurants and bars closed'),
+            html.Div(children='4 = Night curfew / partial lockdown in place for broad population categories'),
+            html.Div(children='5 = All-day lockdown / shelter-in-place government instruction'),
+            #                    html.Div(children='6 = Harsh lockdown (citizens forbidden to leave home even to buy essential items)'),
+        ]
+    return [html.H3(children='Intervention levels')] + [html.Div(children=level + ' = ' + text) for level, text in source.levels.items()]
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def serve_layout():
+    """
+    returns - page layout for the current dataset snapshot (called on every
+    page load, so new dates appear without a restart)
+    """
+
+    registry = dataset_registry()
+    snapshot = current_dataset()
+    date = snapshot.latest
+    opts = [{'label' : i, 'value' : i} for i in snapshot.datelist]
+    datasets = [{'label' : source.label, 'value' : name} for name, source in registry.sources.items()]
+
+    return html.Div(children=[
             
 # ------------
     html.H1(children='Coronavirus counter-measures: global status',            
@@ -132,6 +668,14 @@ app.layout = html.Div(children=[
 # ------------
             dbc.Col(html.Div([
                     
+                dcc.Dropdown(
+                    id = "dataset",
+                    options = datasets,
+                    value = registry.default,
+                    clearable = False,
+                    style = {'padding' : '10px', 'width': '40%', 'display': 'inline-block' if len(datasets) > 1 else 'none'},
+                ),
+
                 dcc.Dropdown(
                     id = "input",
                     options = opts,           
@@ -139,6 +683,17 @@ app.layout = html.Div(children=[
                     style = {'padding' : '10px', 'width': '40%', 'display': 'inline-block'},
                 ),
 
+                dcc.RadioItems(
+                    id = "mode",
+                    options=[
+                        {'label': ' Date', 'value': 'date'},
+                        {'label': ' Animation', 'value': 'animate'},
+                    ],
+                    value = 'date',
+                    labelStyle={'padding' : '5px', 'display': 'inline-block'},
+                    style = {'padding' : '10px', 'display': 'inline-block'},
+                ),
+
 #           dcc.Checklist(
 #            dcc.RadioItems(
 #                id = "check",  
@@ -191,6 +746,7 @@ app.layout = html.Div(children=[
 # ------------
             dbc.Col(html.Div([
                 dcc.Graph(id="output-graph", style = {'padding' : '0px', 'width': '100%', 'display': 'inline-block'}),  
+                dcc.Store(id="levels-store"),
             ]), 
             width={'size':8}, 
             ),
@@ -201,16 +757,7 @@ app.layout = html.Div(children=[
 # ------------
                 dbc.Row(
 
-                    html.P([
-                        html.H3(children='Intervention levels'),
-                        html.Div(children='0 = No or few containment measures in place'),
-                        html.Div(children='1 = Ban on public gatherings, cancellation of major events and conferences'),
-                        html.Div(children=['2 = Schools and universities closed (dates matched to those from ', html.A('UNESCO', href='https://en.unesco.org/themes/education-emergencies/coronavirus-school-closures'), ')']),
-                        html.Div(children='3 = Non-essential shops, restaurants and bars closed'),
-                        html.Div(children='4 = Night curfew / partial lockdown in place for broad population categories'),
-                        html.Div(children='5 = All-day lockdown / shelter-in-place government instruction'),
-                        #                    html.Div(children='6 = Harsh lockdown (citizens forbidden to leave home even to buy essential items)'),
-                    ],
+                    html.P(id="legend", children=legend_children(snapshot.source),
                     style = {'padding' : '20px', 'fontSize' : '12px', 'width': '100%', 'display': 'inline-block'}),   
                 ),
 
@@ -242,119 +789,323 @@ app.layout = html.Div(children=[
     ]), 
 # ------------
 
-])
+# ------------
+    html.Div([
+
+        dbc.Row([
+
+# ------------
+            dbc.Col(html.Div([
+                dcc.Graph(id="region-graph", style = {'padding' : '0px', 'width': '100%', 'display': 'inline-block'}),
+            ]), 
+            width={'size':8}, 
+            ),
+
+# ------------
+            dbc.Col(html.Div(id="region-transitions", style = {'padding' : '20px', 'fontSize' : '12px'}), 
+            width={'size':4}, 
+            ),
+
+        ]),
+
+    ]), 
+# ------------
+
+# ------------
+    html.Div([
+
+        dbc.Row([
+
+# ------------
+            dbc.Col(html.Div([
+                dcc.Graph(id="timeline-graph", style = {'padding' : '0px', 'width': '100%', 'display': 'inline-block'}),
+            ]), 
+            width={'size':8}, 
+            ),
+
+# ------------
+            dbc.Col(html.Div([
+
+                dcc.RadioItems(
+                    id = "timeline-group",
+                    options = [{'label': ' ' + groups[group], 'value': group} for group in dataset_groups(snapshot)],
+                    value = 'all',
+                    labelStyle={'padding' : '5px', 'display': 'block'},
+                ),
+
+                dcc.RadioItems(
+                    id = "timeline-measure",
+                    options = [{'label': ' Regions', 'value': 'counts'}] + ([{'label': ' Population', 'value': 'population'}] if population else []),
+                    value = 'counts',
+                    labelStyle={'padding' : '5px', 'display': 'block'},
+                ),
+
+            ], style = {'padding' : '20px'}), 
+            width={'size':4}, 
+            ),
+
+        ]),
+
+    ]), 
+# ------------
+
+    ])
+#-----------------------------------------------------------------------
+
+app.layout = serve_layout
 
 # ========================================================================
 # Callbacks
 # ========================================================================
            
-@app.callback(
-    Output(component_id='output-graph', component_property='figure'),
-    [Input(component_id='input', component_property='value'), 
-    Input(component_id='radio', component_property='value')],    
-    )
-    
-def update_graph(value, colors):
-    
-    # Create Plotly figure
-    """
-    Plotly dash world map of country-level measures
-    """
-    if colors == 'Viridis':    
-        cmap = px.colors.sequential.Viridis_r
-    elif colors == 'Cividis':    
-        cmap = px.colors.sequential.Cividis_r
-    elif colors == 'Plotly3':
-        cmap = px.colors.sequential.Plotly3_r
-    elif colors == 'Magma':
-        cmap = px.colors.sequential.Magma_r
-    elif colors == 'Shikari':
-#        cmap = ['#d8d7d5','#a1dcfc','#fdee03','#75b82b','#a84190','#0169b3']
-        cmap = ['#2f2f2f','#a1dcfc','#fdee03','#75b82b','#a84190','#0169b3']                                
-    cmap_idx = np.linspace(0,len(cmap)-1, nlabels, dtype=int)
-    colors = [cmap[i] for i in cmap_idx]
-    values = np.array(np.arange(len(colors)+1))
-    colorscale, tickvals, ticktext = discrete_colorscale(values, colors)
-
-#    projections_all = ['equirectangular', 'mercator', 'orthographic', 'natural earth', 'kavrayskiy7', 'miller', 'robinson', 'eckert4', 'azimuthal equal area', 'azimuthal equidistant', 'conic equal area', 'conic conformal', 'conic equidistant', 'gnomonic', 'stereographic', 'mollweide', 'hammer', 'transverse mercator', 'albers usa', 'winkel tripel', 'aitoff', 'sinusoidal']
-#    projections_sub = ['equirectangular', 'natural earth', 'eckert4', 'mollweide', 'albers usa', 'sinusoidal']    
-#    maptype = 'natural earth'   
-#    if maptype == 'Equirectangular':
-#        projection_type = 'equirectangular' 
-#    elif maptype == 'Natural Earth':
-#        projection_type = 'natural earth' 
-#    elif maptype == 'Eckert-4':
-#        projection_type = 'eckert4' 
-#    elif maptype == 'Mollweide':
-#        projection_type = 'mollweide' 
-#    elif maptype == 'Sinusoidal':
-#        projection_type = 'sinusoidal' 
-#    elif maptype == 'Albers USA':
-#        projection_type = 'albers usa' 
-                
-    data = [
-    
-    go.Choropleth(
-            locations = df['country_id'][usa],
-            text = df['country_name'][usa],
-            z = df[value][usa],
-            zmin = 0, 
-            zmax = nlabels,
-            locationmode='USA-states',
-            colorscale = colorscale,
-            colorbar = dict(thickness=15, tickvals=tickvals, ticktext=ticktext),
-            reversescale=False,
-            marker_line_color='darkgray',
-            marker_line_width=0.5,
-            colorbar_tickprefix = '',    
-            colorbar_title = 'Level'),
-
-    go.Choropleth(
-            locations = df['country_id'][world],
-            text = df['country_name'][world],
-            z = df[value][world],
-            zmin = 0, 
-            zmax = nlabels,
-            locationmode='ISO-3',   
-            colorscale = colorscale,
-            colorbar = dict(thickness=15, tickvals=tickvals, ticktext=ticktext),
-            reversescale=False,
-            marker_line_color='darkgray',
-            marker_line_width=0.5,
-            colorbar_tickprefix = '',
-            colorbar_title = 'Level')
-    ]
+# Also runs on page load (the pinned Dash has no prevent_initial_call): it
+# then repeats the defaults of serve_layout() and sends the levels-store.
+def select_dataset(name):
 
-    layout = go.Layout(
-                    
-    title={
-        'text': 'Coronavirus counter-measures: ' + value,
-        'x':0.46,
-        'y':0.95,
-        'xanchor': 'center',
-        'yanchor': 'top',
-    },    
-    geo=dict(
-        scope = 'world',
-        showframe = True,
-        showcoastlines = True,
-        projection_type = 'natural earth',
-#       projection_type = 'equirectangular',
-    ),
-    annotations = [dict(
-        text = 'Data: <a href="https://github.com/OlivierLej/Coronavirus_CounterMeasures">Olivier Lejeune</a>, Visualisation: <a href="https://patternizer.github.io">Michael Taylor</a>',
-        x = 0.5, 
-        y = -0.05, 
-        xanchor = 'center',
-        yanchor = 'bottom',
-        showarrow = False,
+    snapshot = get_dataset(name)
+    opts = [{'label' : i, 'value' : i} for i in snapshot.datelist]
+    group_opts = [{'label': ' ' + groups[group], 'value': group} for group in dataset_groups(snapshot)]
+    store = level_store(snapshot) if clientside else None
+    return opts, snapshot.latest, legend_children(snapshot.source), group_opts, 'all', store
+
+app.callback(
+    [Output(component_id='input', component_property='options'),
+    Output(component_id='input', component_property='value'),
+    Output(component_id='legend', component_property='children'),
+    Output(component_id='timeline-group', component_property='options'),
+    Output(component_id='timeline-group', component_property='value'),
+    Output(component_id='levels-store', component_property='data')],
+    [Input(component_id='dataset', component_property='value')],
+    )(callback_seconds.timed(callback='select_dataset')(select_dataset))
+
+def update_graph(value, colors, mode='date', name=None):
+
+    if mode == 'animate':
+        return json.loads(build_animation_json(get_dataset(name), colors))
+    return json.loads(figure_json(value, colors, name))
+
+if clientside:
+    app.clientside_callback(
+        ClientsideFunction(namespace='countermeasures', function_name='update_graph'),
+        Output(component_id='output-graph', component_property='figure'),
+        [Input(component_id='input', component_property='value'), 
+        Input(component_id='radio', component_property='value'),
+        Input(component_id='mode', component_property='value'),
+        Input(component_id='levels-store', component_property='data')],
+        [State(component_id='output-graph', component_property='figure')],
         )
-    ],
-    margin=dict(r=0, l=0, b=40, t=40), 
-    )
-    
-    return { 'data': data, 'layout':layout }
+else:
+    app.callback(
+        Output(component_id='output-graph', component_property='figure'),
+        [Input(component_id='input', component_property='value'), 
+        Input(component_id='radio', component_property='value'),
+        Input(component_id='mode', component_property='value'),
+        Input(component_id='dataset', component_property='value')],    
+        )(callback_seconds.timed(callback='update_graph')(update_graph))
         
+def update_timeline(group, measure, colors, name=None):
+
+    snapshot = get_dataset(name)
+    if group not in dataset_groups(snapshot):
+        group = 'all'
+    return json.loads(build_timeline_json(snapshot, group, measure, colors))
+
+app.callback(
+    Output(component_id='timeline-graph', component_property='figure'),
+    [Input(component_id='timeline-group', component_property='value'), 
+    Input(component_id='timeline-measure', component_property='value'),
+    Input(component_id='radio', component_property='value'),
+    Input(component_id='dataset', component_property='value')],    
+    )(callback_seconds.timed(callback='update_timeline')(update_timeline))
+
+def update_region(click, name=None):
+
+    snapshot = get_dataset(name)
+    store = run_lengths(snapshot)
+    points = (click or {}).get('points') or [{}]
+    region = points[0].get('location')
+    if region not in store.row:
+        return {}, html.Div(children='Click a region on the map to show its history')
+
+    levels = snapshot.source.levels
+    transitions = [html.H5(children=snapshot.country_name[store.row[region]])]
+    for date, level in store.transitions(region):
+        transitions.append(html.Div(children=date + ': ' + str(level) + ' = ' + levels.get(str(level), 'Level ' + str(level))))
+    return json.loads(build_history_json(snapshot, region)), transitions
+
+app.callback(
+    [Output(component_id='region-graph', component_property='figure'),
+    Output(component_id='region-transitions', component_property='children')],
+    [Input(component_id='output-graph', component_property='clickData'),
+    Input(component_id='dataset', component_property='value')],
+    )(callback_seconds.timed(callback='update_region')(update_region))
+
+# ========================================================================
+# HTTP delivery
+# ========================================================================
+
+"""
+Responses larger than COUNTERMEASURES_COMPRESS_MIN_SIZE bytes (default 500)
+of a text type are compressed with brotli (if the brotli package is
+installed and accepted by the client) or gzip. GET responses without their
+own caching headers get a strong ETag and must be revalidated, so a repeat
+page load costs a 304.
+
+Figures are also served by date for browsers and CDNs:
+
+/figure/<date>.json?colors=C - current data, ETag tied to figure_version(), revalidated
+/figure/<version>/<date>.json?colors=C - immutable, cacheable for a year (version = figure_version())
+
+with &dataset=NAME for a dataset other than the current one, and 'animation'
+in place of the date for the animated map. They are meant for CDNs and
+embedders: the page itself keeps its map callback, which shares the same
+figure cache. (Fetching them from the page would need a blocking request,
+as the clientside callbacks of the pinned Dash cannot wait on a fetch.)
+
+The unversioned URL links to the versioned one, and a stale version
+redirects to the current one. Compressed bodies are kept in an LRU, so a date
+is only built and compressed once per dataset version.
+"""
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+compress_min_size = int(os.environ.get('COUNTERMEASURES_COMPRESS_MIN_SIZE', 500))
+compress_types = ('application/json', 'text/html', 'text/css', 'application/javascript', 'text/javascript')
+immutable_max_age = 365 * 24 * 3600
+
+#-----------------------------------------------------------------------
+def accepted_encoding():
+    """
+    returns - 'br', 'gzip' or None: best encoding accepted by the current request
+    """
+
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def compress(data, encoding):
+    """
+    data - bytes
+    encoding - 'br', 'gzip' or None
+    returns - data encoded accordingly
+    """
+
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    if encoding == 'gzip':
+        return gzip.compress(data, compresslevel=6)
+    return data
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def encoded_figure(snapshot, value, colors, encoding):
+    """
+    snapshot - Dataset
+    value - 'YYYY-MM-DD' or 'animation'
+    colors - name of a colormap in colormaps
+    encoding - 'br', 'gzip' or None
+    returns - serialized figure encoded for transfer
+    """
+
+    def build():
+        if value == 'animation':
+            return build_animation_json(snapshot, colors)
+        return build_figure_json(snapshot, value, colors)
+
+    return snapshot.derived.get('encoded_figure', (value, colors, encoding),
+        lambda: compress(build().encode('utf-8'), encoding), figure_cache_size)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def figure_response(snapshot, value, max_age):
+    """
+    snapshot - Dataset
+    value - 'YYYY-MM-DD' or 'animation'
+    max_age - Cache-Control max-age in seconds (0 = always revalidate)
+    returns - figure response, or 304 if the client already holds it
+    """
+
+    colors = request.args.get('colors', 'Shikari')
+    name = request.args.get('dataset')
+    if (value not in snapshot.date_index and value != 'animation') or colors not in colormaps:
+        abort(404)
+    encoding = accepted_encoding()
+    etag = snapshot.source.key + '-' + figure_version(snapshot) + '-' + value + '-' + colors + ('-' + encoding if encoding else '')
+
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(encoded_figure(snapshot, value, colors, encoding), mimetype='application/json')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    if max_age:
+        response.cache_control.max_age = max_age
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+        response.headers['Link'] = '<' + url_for('versioned_figure', version=figure_version(snapshot), value=value, colors=colors, dataset=name) + '>; rel="canonical"'
+    return response
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def requested_dataset():
+    """
+    returns - Dataset named by the dataset query argument (404 if unknown,
+    503 if its data cannot be read)
+    """
+
+    try:
+        return get_dataset(request.args.get('dataset'))
+    except KeyError:
+        abort(404)
+    except OSError as e:
+        print('** WARNING: dataset ' + str(request.args.get('dataset')) + ' not available (' + str(e) + ')')
+        abort(503)
+#-----------------------------------------------------------------------
+
+@server.route('/figure/<value>.json')
+def current_figure(value):
+    return figure_response(requested_dataset(), value, 0)
+
+@server.route('/figure/<version>/<value>.json')
+def versioned_figure(version, value):
+    snapshot = requested_dataset()
+    if version != figure_version(snapshot):
+        return redirect(url_for('versioned_figure', version=figure_version(snapshot), value=value,
+                                colors=request.args.get('colors'), dataset=request.args.get('dataset')))
+    return figure_response(snapshot, value, immutable_max_age)
+
+@server.after_request
+def finish_response(response):
+
+    if response.direct_passthrough or response.status_code != 200:
+        return response
+    encoding = None
+    compressible = 'Content-Encoding' not in response.headers and response.mimetype in compress_types
+    if compressible:
+        encoding = accepted_encoding() if response.content_length is None or response.content_length >= compress_min_size else None
+        response.vary.add('Accept-Encoding')
+    if request.method == 'GET' and 'ETag' not in response.headers and 'Cache-Control' not in response.headers:
+        response.set_etag(hashlib.sha1(response.get_data()).hexdigest() + ('-' + encoding if encoding else ''))
+        response.cache_control.no_cache = True
+        if response.get_etag()[0] in request.if_none_match:
+            headers = {h: response.headers[h] for h in ('ETag', 'Cache-Control', 'Vary') if h in response.headers}
+            return Response(status=304, headers=headers)
+    if encoding:
+        response.set_data(compress(response.get_data(), encoding))
+        response.headers['Content-Encoding'] = encoding
+    return response
+
 ##################################################################################################
 # Run the dash app
 ##################################################################################################
@@ -0,0 +1,306 @@
+# -*- coding: utf-8 -*-
+
+#-----------------------------------------------------------------------
+# PROGRAM: countermeasures_benchmark.py
+#-----------------------------------------------------------------------
+# Version 0.1
+# 17 October, 2026
+# Dr Michael Taylor
+# https://patternizer.github.io
+# patternizer AT gmail DOT com
+#-----------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+
+from countermeasures_data import DATA_DIR, load_dataset
+
+#-----------------------------------------------------------------------
+# Benchmarks
+#-----------------------------------------------------------------------
+"""
+Measures what we watch in production, using only the bundled CSVs:
+
+import - cold import of countermeasures_app and first data load (fresh process per run)
+callback - update_graph latency (the page's map callback), cold (every cache
+           of the dataset cleared) and warm
+figure - GET /figure/<version>/<date>.json with Accept-Encoding: gzip through
+         the Flask test client (routing, cache lookup and compression), cold and warm
+video - per-frame time of countermeasures_video: figure build, raster
+        backend (if outlines are cached) and image export (if an export
+        engine is installed)
+
+Every scenario runs in a child process with COUNTERMEASURES_DATA_URL pointing
+at the dataset under test, so peak RSS is measured per scenario. --scales
+adds synthetic datasets with the regions and days multiplied by RxD (or N
+for NxN), e.g.
+
+    $ python countermeasures_benchmark.py --scales 1,10x1,1x10,100x1,1x100 --json bench.json
+"""
+
+#-----------------------------------------------------------------------
+def percentiles(samples):
+    """
+    samples - list of timings in seconds
+    returns - dict of n, mean, p50, p90, p99 and max in milliseconds
+    """
+
+    a = np.array(samples) * 1000.0
+    return {'n': len(a), 'mean_ms': float(a.mean()), 'p50_ms': float(np.percentile(a, 50)),
+            'p90_ms': float(np.percentile(a, 90)), 'p99_ms': float(np.percentile(a, 99)), 'max_ms': float(a.max())}
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def skipped(e):
+    """
+    e - exception raised by an optional measurement
+    returns - one line reason for skipping it
+    """
+
+    lines = [l.strip() for l in str(e).splitlines() if l.strip()]
+    return 'skipped: ' + (lines[0] if lines else type(e).__name__)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def peak_rss_mb():
+    """
+    returns - peak resident set size of this process in MB
+    """
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024.0 * 1024.0) if sys.platform == 'darwin' else rss / 1024.0
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def parse_scale(scale):
+    """
+    scale - 'RxD' or 'N'
+    returns - (region factor, day factor)
+    """
+
+    factors = [int(f) for f in scale.lower().split('x')]
+    return (factors[0], factors[-1])
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def make_synthetic(df, region_scale, day_scale, path):
+    """
+    df - dataframe as returned by load_dataset()
+    region_scale, day_scale - factors applied to the number of regions and of days
+    path - output CSV filename
+    returns - path
+    Countries and US states are replicated with numbered ids so every row
+    stays unique (copies of states then count as countries) and the daily
+    series is tiled forward in time.
+    """
+
+    levels = df.iloc[:, 2:].to_numpy(dtype=np.int8)
+    ids, names = [], []
+    for k in range(region_scale):
+        for cid, name in zip(df['country_id'], df['country_name']):
+            ids.append(cid if k == 0 else cid + str(k))
+            names.append(name if k == 0 else name + ' ' + str(k))
+    levels = np.tile(levels, (region_scale, day_scale))
+    dates = pd.date_range(pd.Timestamp(df.columns[2][:8]), periods=levels.shape[1])
+    out = pd.DataFrame(levels, columns=[d.strftime('%Y%m%d') + '_date' for d in dates])
+    out.insert(0, 'country_name', names)
+    out.insert(0, 'country_id', ids)
+    out.to_csv(path, index=False)
+    return path
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def bench_import(repeat):
+    """
+    returns - time to import countermeasures_app in a fresh process, time of the
+    first data load and peak RSS
+    """
+    t0 = time.perf_counter()
+    import countermeasures_app
+    t1 = time.perf_counter()
+    countermeasures_app.current_dataset()
+    return {'import_s': t1 - t0, 'load_s': time.perf_counter() - t1, 'rss_mb': peak_rss_mb()}
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def bench_callback(repeat):
+    """
+    repeat - number of (date, colormap) samples
+    returns - update_graph latency percentiles with empty and warm caches
+    """
+    import countermeasures_app as app
+
+    rng = random.Random(0)
+    keys = [(rng.choice(app.current_dataset().datelist), rng.choice(list(app.colormaps))) for i in range(repeat)]
+
+    cold = []
+    for value, colors in keys:
+        app.current_dataset().derived.clear()
+        t0 = time.perf_counter()
+        app.update_graph(value, colors)
+        cold.append(time.perf_counter() - t0)
+
+    for value, colors in keys:
+        app.update_graph(value, colors)
+    warm = []
+    for value, colors in keys:
+        t0 = time.perf_counter()
+        app.update_graph(value, colors)
+        warm.append(time.perf_counter() - t0)
+
+    return {'cold': percentiles(cold), 'warm': percentiles(warm), 'rss_mb': peak_rss_mb()}
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def bench_figure(repeat):
+    """
+    repeat - number of (date, colormap) samples
+    returns - GET /figure/<version>/<date>.json latency percentiles (gzip)
+    with empty and warm caches
+    """
+    import countermeasures_app as app
+
+    client = app.server.test_client()
+    snapshot = app.current_dataset()
+    rng = random.Random(0)
+    keys = [(rng.choice(snapshot.datelist), rng.choice(list(app.colormaps))) for i in range(repeat)]
+
+    def get(value, colors):
+        url = '/figure/' + app.figure_version(snapshot) + '/' + value + '.json?colors=' + colors
+        response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+        if response.status_code != 200:
+            raise RuntimeError(url + ': ' + response.status)
+
+    cold = []
+    for value, colors in keys:
+        snapshot.derived.clear()
+        t0 = time.perf_counter()
+        get(value, colors)
+        cold.append(time.perf_counter() - t0)
+
+    for value, colors in keys:
+        get(value, colors)
+    warm = []
+    for value, colors in keys:
+        t0 = time.perf_counter()
+        get(value, colors)
+        warm.append(time.perf_counter() - t0)
+
+    return {'cold': percentiles(cold), 'warm': percentiles(warm), 'rss_mb': peak_rss_mb()}
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def bench_video(repeat):
+    """
+    repeat - number of frames (newest dates)
+    returns - per-frame percentiles for figure build, raster backend and image export
+    """
+    import countermeasures_video as video
+
+    dates = video.frame_dates()[-repeat:]
+    projection = video.projections[0]
+    result = {}
+
+    build = []
+    for date in dates:
+        t0 = time.perf_counter()
+        video.make_frame(date, projection)
+        build.append(time.perf_counter() - t0)
+    result['figure'] = percentiles(build)
+
+    try:
+        from countermeasures_raster import RasterRenderer, load_geometry
+        t0 = time.perf_counter()
+        renderer = RasterRenderer(video.current_dataset(), video.colors, projection, load_geometry())
+        result['raster_setup_s'] = time.perf_counter() - t0
+        raster = []
+        for date in dates:
+            t0 = time.perf_counter()
+            renderer.render(date)
+            raster.append(time.perf_counter() - t0)
+        result['raster'] = percentiles(raster)
+    except Exception as e:
+        result['raster'] = skipped(e)
+
+    try:
+        export = []
+        for date in dates[:max(1, repeat // 10)]:
+            t0 = time.perf_counter()
+            video.render_image((date, projection))
+            export.append(time.perf_counter() - t0)
+        result['export'] = percentiles(export)
+    except Exception as e:
+        result['export'] = skipped(e)
+
+    result['rss_mb'] = peak_rss_mb()
+    return result
+#-----------------------------------------------------------------------
+
+benchmarks = {'import': bench_import, 'callback': bench_callback, 'figure': bench_figure, 'video': bench_video}
+
+#-----------------------------------------------------------------------
+def run_child(name, data_file, repeat):
+    """
+    name - benchmark name
+    data_file - dataset CSV to benchmark against
+    repeat - number of samples
+    returns - dict of results reported by the child process
+    """
+
+    env = dict(os.environ, COUNTERMEASURES_DATA_URL=data_file, PYTHONWARNINGS='ignore')
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), '--child', name, '--repeat', str(repeat)],
+                         env=env, cwd=DATA_DIR, stdout=subprocess.PIPE, check=True)
+    return json.loads(out.stdout.decode('utf-8').strip().splitlines()[-1])
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def main():
+
+    parser = argparse.ArgumentParser(description='Benchmark app startup, callback latency and video frame rendering')
+    parser.add_argument('--scales', default='1', help='comma separated dataset scales, RxD or N (default 1)')
+    parser.add_argument('--repeat', type=int, default=50, help='samples per measurement (default 50)')
+    parser.add_argument('--only', default=','.join(benchmarks), help='comma separated subset of: ' + ', '.join(benchmarks))
+    parser.add_argument('--json', default=None, help='also write the results to this file')
+    parser.add_argument('--geometry', default=None, help='TopoJSON / GeoJSON outlines for the raster backend')
+    parser.add_argument('--child', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(benchmarks[args.child](args.repeat)))
+        return
+
+    if args.geometry:
+        os.environ['COUNTERMEASURES_GEOMETRY'] = os.path.abspath(args.geometry)
+
+    df = load_dataset()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for scale in args.scales.split(','):
+            region_scale, day_scale = parse_scale(scale)
+            key = str(region_scale) + 'x' + str(day_scale)
+            data_file = make_synthetic(df, region_scale, day_scale, os.path.join(tmp, 'dataset_' + key + '.csv'))
+            results[key] = {'size_mb': os.path.getsize(data_file) / 1e6}
+            for name in args.only.split(','):
+                if name == 'import':
+                    runs = [run_child(name, data_file, args.repeat) for i in range(max(1, args.repeat // 10))]
+                    results[key][name] = dict(percentiles([r['import_s'] for r in runs]), load=percentiles([r['load_s'] for r in runs]), rss_mb=max(r['rss_mb'] for r in runs))
+                else:
+                    results[key][name] = run_child(name, data_file, args.repeat)
+                print('** ' + key + ' ' + name + ': ' + json.dumps(results[key][name]))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+#-----------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,828 @@
+# -*- coding: utf-8 -*-
+
+#-----------------------------------------------------------------------
+# PROGRAM: countermeasures_data.py
+#-----------------------------------------------------------------------
+# Version 0.1
+# 17 October, 2026
+# Dr Michael Taylor
+# https://patternizer.github.io
+# patternizer AT gmail DOT com
+#-----------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import threading
+import tempfile
+import hashlib
+import argparse
+import urllib.request
+import urllib.error
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+#-----------------------------------------------------------------------
+# Data sources
+#-----------------------------------------------------------------------
+"""
+Daily updated Coronavirus containment measures taken by governments from 2020-01-23 to date
+Provided by Olivier Lejeune: http://www.olejeune.com/ at:
+https://github.com/OlivierLej/Coronavirus_CounterMeasures
+dataset.csv has structure: country_id, country_name, 20200123_date, ...
+
+USA data is at state level and uses the alpha-2 code FIPS convention.
+Country data uses the alpha-3 code FIPS convention.
+
+The bundled copy of dataset.csv is read by default so that import needs no
+network. Set COUNTERMEASURES_DATA_URL to read the dataset from a remote URL
+instead: the download is kept in an on-disk cache and only revalidated
+(ETag / Last-Modified) once COUNTERMEASURES_CACHE_MAX_AGE seconds have passed
+since the last check.
+"""
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+DATASET_FILE = os.path.join(DATA_DIR, 'dataset.csv')
+
+DATASET_URL = r'https://raw.githubusercontent.com/OlivierLej/Coronavirus_CounterMeasures/master/dataset.csv'
+#DATASET_URL = r'https://raw.githubusercontent.com/patternizer/Coronavirus_CounterMeasures/master/dataset.csv'
+
+CACHE_DIR = os.environ.get('COUNTERMEASURES_CACHE_DIR', os.path.join(DATA_DIR, '.cache'))
+CACHE_MAX_AGE = float(os.environ.get('COUNTERMEASURES_CACHE_MAX_AGE', 3600))
+FETCH_TIMEOUT = 10
+
+# Intervention levels of the bundled dataset
+countermeasures = {
+'0': 'No or few containment measures in place',
+'1': 'Ban on public gatherings, cancellation of major events and conferences',
+'2': 'Schools and universities closed (dates matched to those from Unesco https://en.unesco.org/themes/education-emergencies/coronavirus-school-closures',
+'3': 'Non-essential shops, restaurants and bars closed',
+'4': 'Night curfew / partial lockdown in place for broad population categories',
+'5': 'All-day lockdown / shelter-in-place government instruction (citizens allowed to venture come out for essential items',
+#'6': 'Harsh lockdown (citizens forbidden to leave home even to buy essential items)'
+}
+
+#-----------------------------------------------------------------------
+def atomic_write(path, data):
+    """
+    path - destination file
+    data - bytes to write
+    Writes to a temporary file in the same directory and renames it into place
+    so that concurrent readers never see a partially written file.
+    """
+
+    dirname = os.path.dirname(os.path.abspath(path))
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=dirname, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def fetch_cached(url, cache_dir=CACHE_DIR, max_age=CACHE_MAX_AGE, timeout=FETCH_TIMEOUT):
+    """
+    url - remote file to fetch
+    cache_dir - directory holding cached copies and their ETag / Last-Modified metadata
+    max_age - seconds a cached copy is trusted before it is revalidated
+    returns - path to an up to date local copy of url
+    Falls back to the cached copy if the server cannot be reached.
+    """
+
+    key = hashlib.sha1(url.encode('utf-8')).hexdigest()[:16]
+    path = os.path.join(cache_dir, key + '_' + os.path.basename(url))
+    meta_path = path + '.json'
+
+    meta = {}
+    if os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if time.time() - os.path.getmtime(meta_path) < max_age:
+            return path
+
+    request = urllib.request.Request(url)
+    if meta.get('etag'):
+        request.add_header('If-None-Match', meta['etag'])
+    if meta.get('last_modified'):
+        request.add_header('If-Modified-Since', meta['last_modified'])
+
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            data = response.read()
+            meta = {'url': url, 'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')}
+        atomic_write(path, data)
+    except urllib.error.HTTPError as e:
+        if e.code != 304:
+            if not meta:
+                raise
+    except (urllib.error.URLError, OSError):
+        if not meta:
+            raise
+
+    # Touch the metadata so the next revalidation waits another max_age
+    atomic_write(meta_path, json.dumps(meta).encode('utf-8'))
+    return path
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def dataset_path(url=None, fallback=True):
+    """
+    url - remote dataset URL or local file path (default: $COUNTERMEASURES_DATA_URL)
+    fallback - use the bundled dataset.csv if url cannot be read (else raise)
+    returns - local path of the dataset CSV (cached remote copy or bundled file)
+    """
+
+    url = url or os.environ.get('COUNTERMEASURES_DATA_URL')
+    if not url:
+        return DATASET_FILE
+    if os.path.exists(url):
+        return url
+    try:
+        if '://' not in url:
+            raise FileNotFoundError('dataset file not found: ' + url)
+        return fetch_cached(url)
+    except (urllib.error.URLError, OSError) as e:
+        if not fallback:
+            raise
+        print('** WARNING: could not fetch ' + url + ' (' + str(e) + '), using bundled dataset.csv')
+        return DATASET_FILE
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def load_dataset(url=None, fallback=True):
+    """
+    url - remote dataset URL (default: $COUNTERMEASURES_DATA_URL, else bundled dataset.csv)
+    fallback - see dataset_path()
+    returns - dataframe with columns country_id, country_name, YYYYMMDD_date, ...
+    """
+
+    return pd.read_csv(dataset_path(url, fallback))
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+class DatasetSource(object):
+    """
+    Where a dataset comes from and how to draw it:
+
+    name - key used in URLs and the layout selector
+    label - text shown in the selector
+    url - dataset CSV URL or path (None: $COUNTERMEASURES_DATA_URL, else bundled dataset.csv;
+          only default_source falls back to the bundled file if url cannot be read)
+    snapshot - binary snapshot path (None: $COUNTERMEASURES_SNAPSHOT)
+    levels - dict 'level' --> description of the level scale
+    locationmode - 'auto' (alpha-2 ids as USA-states, alpha-3 ids as ISO-3) or a
+                   plotly locationmode for every region: 'ISO-3', 'USA-states',
+                   'country names' or 'geojson-id'
+    geojson - URL of the region outlines for 'geojson-id'
+    featureidkey - property of the geojson features matched against country_id
+    """
+
+    def __init__(self, name, label=None, url=None, snapshot=None, levels=None, locationmode='auto', geojson=None, featureidkey='id'):
+
+        self.name = name
+        self.label = label or name
+        self.url = url
+        self.snapshot = snapshot
+        self.levels = dict(levels or countermeasures)
+        self.locationmode = locationmode
+        self.geojson = geojson
+        self.featureidkey = featureidkey
+
+    @property
+    def nlevels(self):
+        return len(self.levels)
+
+    @property
+    def key(self):
+        """
+        returns - name plus a short hash of the drawing settings, for caches
+        shared between processes (the same data may be drawn by several sources)
+        """
+        settings = json.dumps([self.levels, self.locationmode, self.geojson, self.featureidkey], sort_keys=True)
+        return self.name + '-' + hashlib.sha1(settings.encode('utf-8')).hexdigest()[:8]
+
+    def open(self):
+        """
+        returns - Dataset read from the source, with .source set to it
+        (raises OSError if the data cannot be read)
+        """
+        dataset = open_dataset(self.url, self.snapshot, fallback=self is default_source)
+        dataset.source = self
+        return dataset
+
+default_source = DatasetSource('countermeasures', 'Countries and US states')
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def sizeof(value):
+    """
+    value - str, bytes, array-like with nbytes, or dict / list / tuple of those
+    returns - approximate bytes held by value
+    """
+
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if hasattr(value, 'nbytes'):
+        return int(value.nbytes)
+    if isinstance(value, dict):
+        return sum(sizeof(k) + sizeof(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return sum(sizeof(v) for v in value) + 8 * len(value)
+    return sys.getsizeof(value)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+class DerivedCache(object):
+    """
+    Values computed from one Dataset (figures, aggregates), kept with it so
+    that they are dropped together: one LRU per kind of value, with the
+    approximate bytes held in nbytes and hit / miss counts per kind.
+    """
+
+    def __init__(self):
+
+        self.lock = threading.Lock()
+        self.clear()
+
+    def get(self, kind, key, build, maxsize=None):
+        """
+        kind - name of the LRU
+        key - hashable key within kind
+        build - callable returning the value on a miss
+        maxsize - entries kept in kind (None = unbounded)
+        returns - the cached or newly built value
+        """
+        with self.lock:
+            entries = self.kinds.setdefault(kind, OrderedDict())
+            if key in entries:
+                entries.move_to_end(key)
+                self.hits[kind] = self.hits.get(kind, 0) + 1
+                return entries[key][0]
+        value = build()
+        size = sizeof(value)
+        with self.lock:
+            self.misses[kind] = self.misses.get(kind, 0) + 1
+            entries = self.kinds.setdefault(kind, OrderedDict())
+            if key not in entries:
+                entries[key] = (value, size)
+                self.nbytes += size
+                while maxsize is not None and len(entries) > maxsize:
+                    self.nbytes -= entries.popitem(last=False)[1][1]
+        return value
+
+    def clear(self, kind=None):
+        """
+        kind - name of the LRU to empty (default: all of them)
+        """
+        with self.lock:
+            if kind is None:
+                self.kinds, self.hits, self.misses, self.nbytes = {}, {}, {}, 0
+            elif kind in self.kinds:
+                self.nbytes -= sum(size for value, size in self.kinds.pop(kind).values())
+
+    def stats(self):
+        """
+        returns - dict kind --> (hits, misses, entries)
+        """
+        with self.lock:
+            kinds = set(self.kinds) | set(self.hits) | set(self.misses)
+            return {k: (self.hits.get(k, 0), self.misses.get(k, 0), len(self.kinds.get(k, ()))) for k in kinds}
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+class Dataset(object):
+    """
+    Parsed, read-only view of the wide dataset table:
+
+    country_id, country_name - region codes and names (numpy object arrays)
+    usa, world - row offsets of US states (alpha-2 ids) and countries (alpha-3 ids)
+    dates - DatetimeIndex of the daily columns
+    datelist - the same dates as 'YYYY-MM-DD' strings
+    date_index - dict 'YYYY-MM-DD' --> column offset into levels
+    levels - (regions x days) int8 matrix of intervention levels (may be a
+             read-only memory map of a binary snapshot)
+    version - short content hash of the above, changes whenever the data does
+    load_seconds - time open_dataset() took to produce it (None if built directly)
+    source - DatasetSource it was read from (level legend and locationmode)
+    derived - DerivedCache of figures and aggregates built from it
+    nbytes - approximate memory held, derived values included
+    """
+
+    def __init__(self, country_id, country_name, dates, levels, usa=None, world=None):
+
+        self.country_id = np.array(country_id, dtype=object)
+        self.country_name = np.array(country_name, dtype=object)
+        self.dates = pd.DatetimeIndex(dates)
+        self.datelist = [d.strftime('%Y-%m-%d') for d in self.dates]
+        self.date_index = {d: i for i, d in enumerate(self.datelist)}
+        self.levels = np.ascontiguousarray(levels, dtype=np.int8)
+
+        if usa is None or world is None:
+            id_length = np.array([len(c) for c in self.country_id])
+            usa = np.flatnonzero(id_length < 3)
+            world = np.flatnonzero(id_length > 2)
+        self.usa = np.array(usa, dtype=np.intp)
+        self.world = np.array(world, dtype=np.intp)
+
+        for a in (self.country_id, self.country_name, self.levels, self.usa, self.world):
+            a.setflags(write=False)
+        self._version = None
+        self._traces = None
+        self.load_seconds = None
+        self.source = default_source
+        self.derived = DerivedCache()
+        self._fixed_nbytes = sum(sizeof(a) for a in (self.levels, self.usa, self.world)) + \
+            sum(sizeof(a) + sum(len(c) for c in a) for a in (self.country_id, self.country_name))
+
+    def column(self, date):
+        """
+        date - 'YYYY-MM-DD'
+        returns - levels of every region on date (raises KeyError for unknown dates)
+        """
+        return self.levels[:, self.date_index[date]]
+
+    def dates_to(self, date):
+        """
+        date - 'YYYY-MM-DD'
+        returns - list of dates from the start of the record up to and including date
+        """
+        return self.datelist[:self.date_index[date]+1]
+
+    @property
+    def latest(self):
+        return self.datelist[-1]
+
+    @property
+    def nbytes(self):
+        return self._fixed_nbytes + self.derived.nbytes
+
+    def traces(self):
+        """
+        returns - list of (row offsets, plotly locationmode), one per map trace
+        """
+        if self._traces is None:
+            if self.source.locationmode == 'auto':
+                self._traces = [(self.usa, 'USA-states'), (self.world, 'ISO-3')]
+            else:
+                self._traces = [(np.arange(len(self.country_id)), self.source.locationmode)]
+        return self._traces
+
+    @property
+    def version(self):
+        if self._version is None:
+            digest = hashlib.sha1()
+            digest.update('\n'.join(self.datelist).encode('utf-8'))
+            digest.update('\n'.join(self.country_id).encode('utf-8'))
+            digest.update('\n'.join(self.country_name).encode('utf-8'))
+            digest.update(self.levels.tobytes())
+            self._version = digest.hexdigest()[:16]
+        return self._version
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def parse_dataset(df):
+    """
+    df - dataframe as returned by load_dataset()
+    returns - Dataset with the YYYYMMDD_date columns parsed once into a
+    DatetimeIndex and the values packed into an int8 matrix
+    """
+
+    date_columns = df.columns[2:]
+    dates = pd.to_datetime(date_columns.str[:8], format='%Y%m%d')
+    levels = df[date_columns].to_numpy(dtype=np.int8)
+    return Dataset(df['country_id'].to_numpy(), df['country_name'].to_numpy(), dates, levels)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+# Binary snapshot
+#-----------------------------------------------------------------------
+"""
+A snapshot holds a whole Dataset in one file so that processes can memory-map
+it instead of parsing the CSV: gunicorn workers then share the levels through
+the OS page cache. Layout:
+
+    SNAPSHOT_MAGIC | uint32 header length | JSON header | padding | int8 levels
+
+The JSON header carries the region ids and names, the usa / world partition,
+the dates and the shape and byte offset of the (regions x days) levels, which
+start on a 64 byte boundary. Set COUNTERMEASURES_SNAPSHOT to the snapshot
+path to load it in place of the CSV, and write it with:
+
+    $ python countermeasures_data.py --snapshot dataset.cmsnap
+"""
+
+SNAPSHOT_MAGIC = b'CMSNAP01'
+SNAPSHOT_FILE = os.environ.get('COUNTERMEASURES_SNAPSHOT')
+
+#-----------------------------------------------------------------------
+def write_snapshot(dataset, path):
+    """
+    dataset - Dataset to store
+    path - output filename (replaced atomically)
+    """
+
+    header = {
+        'country_id': list(dataset.country_id),
+        'country_name': list(dataset.country_name),
+        'usa': dataset.usa.tolist(),
+        'world': dataset.world.tolist(),
+        'dates': dataset.datelist,
+        'shape': list(dataset.levels.shape),
+    }
+    prefix = len(SNAPSHOT_MAGIC) + 4
+    offset = 0
+    while True:
+        header['offset'] = offset
+        blob = json.dumps(header).encode('utf-8')
+        needed = -(-(prefix + len(blob)) // 64) * 64
+        if needed == offset:
+            break
+        offset = needed
+    padding = b' ' * (offset - prefix - len(blob))
+    data = SNAPSHOT_MAGIC + np.uint32(len(blob) + len(padding)).tobytes() + blob + padding + dataset.levels.tobytes()
+    atomic_write(path, data)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def read_snapshot(path):
+    """
+    path - snapshot written by write_snapshot()
+    returns - Dataset whose levels are a read-only memory map of the file
+    """
+
+    with open(path, 'rb') as f:
+        if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError(path + ' is not a countermeasures snapshot')
+        length = int(np.frombuffer(f.read(4), dtype=np.uint32)[0])
+        header = json.loads(f.read(length).decode('utf-8'))
+
+    levels = np.memmap(path, dtype=np.int8, mode='r', offset=header['offset'], shape=tuple(header['shape']))
+    return Dataset(header['country_id'], header['country_name'], pd.to_datetime(header['dates']), levels,
+                   usa=header['usa'], world=header['world'])
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def open_dataset(url=None, snapshot=None, fallback=True):
+    """
+    url - remote dataset URL or local file path (default: $COUNTERMEASURES_DATA_URL)
+    snapshot - binary snapshot path (default: $COUNTERMEASURES_SNAPSHOT, '' for none)
+    fallback - read the bundled dataset.csv if neither can be read (else raise)
+    returns - Dataset memory-mapped from the snapshot if there is one, else parsed from the CSV
+    """
+
+    t0 = time.perf_counter()
+    if snapshot is None:
+        snapshot = SNAPSHOT_FILE
+    if snapshot and os.path.exists(snapshot):
+        dataset = read_snapshot(snapshot)
+    elif snapshot and not url and not fallback:
+        raise FileNotFoundError('dataset snapshot not found: ' + snapshot)
+    else:
+        dataset = parse_dataset(load_dataset(url, fallback))
+    dataset.load_seconds = time.perf_counter() - t0
+    return dataset
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+# Current dataset
+#-----------------------------------------------------------------------
+"""
+The process-wide current snapshot is loaded on first use rather than at
+import, so modules can be imported (by tests, benchmarks or batch tools)
+without network or parsing cost. publish_dataset() replaces it as a whole.
+"""
+
+_current = None
+_current_lock = threading.Lock()
+
+#-----------------------------------------------------------------------
+def current_dataset():
+    """
+    returns - the current Dataset, opened with open_dataset() on first call
+    """
+
+    global _current
+    if _current is None:
+        with _current_lock:
+            if _current is None:
+                _current = open_dataset()
+    return _current
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def publish_dataset(dataset):
+    """
+    dataset - Dataset to make current
+    returns - the previous current Dataset (or None)
+    """
+
+    global _current
+    with _current_lock:
+        old, _current = _current, dataset
+    return old
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def dataset_stamp(url=None):
+    """
+    url - remote dataset URL or local file path (default: $COUNTERMEASURES_DATA_URL)
+    returns - (path, mtime, size) of the snapshot if $COUNTERMEASURES_SNAPSHOT
+    exists, else of the local dataset file: changes whenever a new version has
+    been written or downloaded
+    """
+
+    if SNAPSHOT_FILE and os.path.exists(SNAPSHOT_FILE):
+        path = SNAPSHOT_FILE
+    else:
+        path = dataset_path(url)
+    st = os.stat(path)
+    return (path, st.st_mtime, st.st_size)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def start_refresher(on_update, interval, url=None):
+    """
+    on_update - called with the new Dataset whenever the data source changes
+    interval - polling interval in seconds
+    url - remote dataset URL or local file path (default: $COUNTERMEASURES_DATA_URL)
+    returns - the daemon thread doing the polling
+    """
+
+    def poll(stamp):
+        while True:
+            time.sleep(interval)
+            try:
+                new_stamp = dataset_stamp(url)
+                if new_stamp != stamp:
+                    on_update(open_dataset(url))
+                    stamp = new_stamp
+            except Exception as e:
+                print('** WARNING: dataset refresh failed (' + str(e) + ')')
+
+    thread = threading.Thread(target=poll, args=(dataset_stamp(url),), name='dataset-refresher')
+    thread.daemon = True
+    thread.start()
+    return thread
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+# Dataset registry
+#-----------------------------------------------------------------------
+"""
+Further datasets (sub-national regions, other level scales) are listed in a
+JSON file named by $COUNTERMEASURES_DATASETS:
+
+    [{"name": "regions", "label": "Sub-national regions", "url": "regions.csv",
+      "levels": {"0": "None", "1": "Advisory", "2": "Mandatory"},
+      "locationmode": "geojson-id", "geojson": "https://.../regions.geojson",
+      "featureidkey": "properties.code"}]
+
+with the keyword arguments of DatasetSource (url or snapshot is required;
+relative paths are read from the directory of the JSON file). A dataset
+whose data cannot be read raises instead of falling back to dataset.csv.
+The bundled dataset is always first and is the current dataset above, kept
+for the life of the process and hot reloaded by the refresher. The others
+are only read when first asked for and kept in an LRU: once their levels
+exceed $COUNTERMEASURES_DATASET_MEMORY_MB (default 256) in total the least
+recently used ones are dropped. The budget counts each dataset with its
+DerivedCache, where the app keeps the figures and aggregates built from it,
+and is checked on every access; an evicted dataset's cache is emptied at
+once. Listing datasets therefore costs nothing at startup, and a worker only
+holds the ones its users look at.
+"""
+
+DATASETS_FILE = os.environ.get('COUNTERMEASURES_DATASETS')
+DATASET_MEMORY_BUDGET = float(os.environ.get('COUNTERMEASURES_DATASET_MEMORY_MB', 256)) * 1024 * 1024
+
+#-----------------------------------------------------------------------
+def load_sources(path=DATASETS_FILE):
+    """
+    path - JSON list of DatasetSource keyword arguments (default: $COUNTERMEASURES_DATASETS)
+    returns - list of DatasetSource, default_source first
+    """
+
+    sources = [default_source]
+    if not path:
+        return sources
+    with open(path) as f:
+        entries = json.load(f)
+    base = os.path.dirname(os.path.abspath(path))
+    for entry in entries:
+        if not entry.get('url') and not entry.get('snapshot'):
+            raise ValueError('dataset ' + str(entry.get('name')) + ' in ' + path + ' needs a url or snapshot')
+        for field in ('url', 'snapshot'):
+            value = entry.get(field)
+            if value and '://' not in value and not os.path.isabs(value):
+                entry[field] = os.path.join(base, value)
+        entry.setdefault('snapshot', '')
+        source = DatasetSource(**entry)
+        if source.name in [s.name for s in sources]:
+            raise ValueError('duplicate dataset name in ' + path + ': ' + source.name)
+        sources.append(source)
+    return sources
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+class DatasetRegistry(object):
+    """
+    Datasets by name, loaded on first use:
+
+    sources - list of DatasetSource, the first one being the current dataset
+    budget - bytes the other loaded datasets, with their derived caches, may
+             hold before the least recently used are evicted (the one just
+             asked for is always kept)
+    """
+
+    def __init__(self, sources, budget=DATASET_MEMORY_BUDGET):
+
+        self.sources = OrderedDict((source.name, source) for source in sources)
+        self.default = sources[0].name
+        self.budget = budget
+        self.loaded = OrderedDict()
+        self.lock = threading.Lock()
+        self.loading = {name: threading.Lock() for name in self.sources}
+
+    def get(self, name=None):
+        """
+        name - dataset name (default: the current dataset)
+        returns - Dataset (raises KeyError for unknown names)
+        """
+        name = name or self.default
+        source = self.sources[name]
+        if name == self.default:
+            self.trim()
+            return current_dataset()
+        with self.lock:
+            dataset = self.loaded.get(name)
+        if dataset is None:
+            with self.loading[name]:
+                with self.lock:
+                    dataset = self.loaded.get(name)
+                if dataset is None:
+                    dataset = source.open()
+                    with self.lock:
+                        self.loaded[name] = dataset
+        with self.lock:
+            if name in self.loaded:
+                self.loaded.move_to_end(name)
+        self.trim()
+        return dataset
+
+    def trim(self):
+        """
+        Evicts the least recently used datasets (never the most recent one)
+        until the loaded ones fit the budget, emptying their derived caches.
+        """
+        evicted = []
+        with self.lock:
+            while len(self.loaded) > 1 and self.nbytes() > self.budget:
+                evicted.append(self.loaded.popitem(last=False)[1])
+        for dataset in evicted:
+            dataset.derived.clear()
+
+    def nbytes(self):
+        """
+        returns - bytes held by the loaded datasets other than the current one
+        """
+        return sum(dataset.nbytes for dataset in list(self.loaded.values()))
+#-----------------------------------------------------------------------
+
+_registry = None
+
+#-----------------------------------------------------------------------
+def dataset_registry():
+    """
+    returns - the process-wide DatasetRegistry of load_sources(), built on first call
+    """
+
+    global _registry
+    if _registry is None:
+        with _current_lock:
+            if _registry is None:
+                _registry = DatasetRegistry(load_sources())
+    return _registry
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+# Summary cube
+#-----------------------------------------------------------------------
+"""
+Aggregates over time are read from a (days x levels x groups) cube built once
+per dataset snapshot: groups are 'all' regions, 'usa' (states) and 'world'
+(countries), split with the existing usa / world row indices. Each slice is
+one matrix product of the group weights with the one-hot levels, so building
+it is a handful of vectorized passes over the levels matrix.
+
+If $COUNTERMEASURES_POPULATION names a CSV with columns country_id,population
+a second, population-weighted cube is built alongside the region counts.
+"""
+
+POPULATION_FILE = os.environ.get('COUNTERMEASURES_POPULATION')
+GROUPS = ('all', 'usa', 'world')
+
+#-----------------------------------------------------------------------
+def load_population(path=POPULATION_FILE):
+    """
+    path - CSV with columns country_id, population (default: $COUNTERMEASURES_POPULATION)
+    returns - dict country_id --> population, or None if no file is configured
+    """
+
+    if not path:
+        return None
+    df = pd.read_csv(path, dtype={'country_id': str})
+    return dict(zip(df['country_id'], df['population'].astype(float)))
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+class Summary(object):
+    """
+    Per-day level totals of a Dataset:
+
+    dataset - Dataset
+    population - optional dict country_id --> population (regions missing from it weigh 0)
+
+    counts - (days x levels x groups) number of regions
+    population - (days x levels x groups) population, or None
+    peak - dict measure --> (levels x groups) day offset at which each total peaked
+    """
+
+    def __init__(self, dataset, population=None):
+
+        self.datelist = dataset.datelist
+        self.groups = GROUPS
+        nlevels = int(dataset.levels.max()) + 1 if dataset.levels.size else 1
+        self.levels = list(range(nlevels))
+
+        masks = np.zeros((len(GROUPS), len(dataset.country_id)))
+        masks[0] = 1.0
+        masks[1, dataset.usa] = 1.0
+        masks[2, dataset.world] = 1.0
+
+        self.counts = self._cube(dataset.levels, masks, nlevels).round().astype(np.int32)
+        self.population = None
+        if population is not None:
+            weights = np.array([population.get(c, 0.0) for c in dataset.country_id])
+            self.population = self._cube(dataset.levels, masks * weights, nlevels)
+
+        self.peak = {'counts': self.counts.argmax(axis=0)}
+        if self.population is not None:
+            self.peak['population'] = self.population.argmax(axis=0)
+
+    @staticmethod
+    def _cube(levels, weights, nlevels):
+        """
+        levels - (regions x days) int8 matrix
+        weights - (groups x regions) weight of each region in each group
+        returns - (days x levels x groups) weighted totals
+        """
+        cube = np.empty((levels.shape[1], nlevels, weights.shape[0]))
+        for level in range(nlevels):
+            cube[:, level, :] = (levels == level).T.astype(float) @ weights.T
+        return cube
+
+    @property
+    def nbytes(self):
+        return self.counts.nbytes + (self.population.nbytes if self.population is not None else 0)
+
+    def series(self, group, measure='counts'):
+        """
+        group - one of GROUPS
+        measure - 'counts' or 'population'
+        returns - (days x levels) totals of group
+        """
+        return getattr(self, measure)[:, :, self.groups.index(group)]
+
+    def peak_dates(self, group, measure='counts'):
+        """
+        group - one of GROUPS
+        measure - 'counts' or 'population'
+        returns - list of (level, 'YYYY-MM-DD', total) at the peak of each level
+        """
+        g = self.groups.index(group)
+        totals = getattr(self, measure)
+        return [(level, self.datelist[d], totals[d, level, g].item()) for level, d in enumerate(self.peak[measure][:, g])]
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def main():
+
+    parser = argparse.ArgumentParser(description='Convert the countermeasures dataset to a binary snapshot')
+    parser.add_argument('--url', default=None, help='dataset URL or CSV path (default: $COUNTERMEASURES_DATA_URL, else bundled dataset.csv)')
+    parser.add_argument('--snapshot', required=True, help='output snapshot path')
+    args = parser.parse_args()
+
+    dataset = parse_dataset(load_dataset(args.url))
+    write_snapshot(dataset, args.snapshot)
+    print('** wrote ' + args.snapshot + ': ' + str(dataset.levels.shape[0]) + ' regions x ' + str(dataset.levels.shape[1]) + ' days')
+#-----------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
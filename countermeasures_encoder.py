@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+
+#-----------------------------------------------------------------------
+# PROGRAM: countermeasures_encoder.py
+#-----------------------------------------------------------------------
+# Version 0.1
+# 17 October, 2026
+# Dr Michael Taylor
+# https://patternizer.github.io
+# patternizer AT gmail DOT com
+#-----------------------------------------------------------------------
+
+import io
+import glob
+import struct
+import numpy as np
+from PIL import Image, GifImagePlugin
+
+#-----------------------------------------------------------------------
+# Streaming animation encoders
+#-----------------------------------------------------------------------
+"""
+Frames are appended one at a time and written to the output immediately, so
+peak memory is one decoded frame however many days the series covers.
+
+GIF - each frame is quantized on arrival to its own local colour table and
+      written straight to the file, so colours first seen late in the series
+      are reproduced as faithfully as those of the first day.
+GIF (delta) - each frame is compared with the previous one and only the
+      rectangle bounding the changed pixels is written, with unchanged pixels
+      inside it left transparent and the previous frame kept underneath
+      (disposal 1). Identical consecutive frames are merged into one longer
+      frame. A single rectangle is written per frame rather than one per
+      region because browsers clamp zero-delay sub-frames to ~100 ms.
+MP4 - frames are piped to ffmpeg through imageio / imageio-ffmpeg.
+"""
+
+# Palette index reserved for transparent pixels in delta frames
+TRANSPARENT = 255
+
+#-----------------------------------------------------------------------
+class GifWriter(object):
+    """
+    Streaming animated GIF writer:
+
+    fp_out - output filename
+    duration - display time of each frame in milliseconds
+    loop - number of loops (0 = forever)
+    """
+
+    def __init__(self, fp_out, duration=200, loop=0):
+
+        self.fp_out = fp_out
+        self.duration = duration
+        self.loop = loop
+        self.size = None
+        self.nframes = 0
+        self.fp = open(fp_out, 'wb')
+
+    def _write_header(self, size):
+        """
+        size - (width, height) of the canvas
+        """
+        self.size = size
+        self.fp.write(b'GIF89a' + struct.pack('<HHBBB', size[0], size[1], 0, 0, 0))
+        self.fp.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', self.loop) + b'\0')
+
+    def _write_frame(self, image, offset=(0, 0), mask=None, **params):
+        """
+        image - RGB image to write
+        offset - position of image on the canvas
+        mask - optional boolean array, False where the pixel is left transparent
+        params - graphic control parameters (duration, disposal)
+        """
+        if mask is None:
+            frame = image.quantize(colors=256)
+        else:
+            frame = image.quantize(colors=255)
+            indices = np.where(mask, np.asarray(frame), TRANSPARENT).astype(np.uint8)
+            palette = frame.getpalette()[:765]
+            frame = Image.frombytes('P', image.size, indices.tobytes())
+            frame.putpalette(palette + [0] * (768 - len(palette)))
+            params['transparency'] = TRANSPARENT
+        params['include_color_table'] = True
+        self.fp.write(b''.join(GifImagePlugin.getdata(frame, offset=offset, **params)))
+
+    def append(self, image):
+        """
+        image - PIL image of the next frame (must match the size of the first)
+        """
+        image = image.convert('RGB')
+        if self.size is None:
+            self._write_header(image.size)
+        elif image.size != self.size:
+            raise ValueError('frame size ' + str(image.size) + ' does not match ' + str(self.size))
+        self._write_frame(image, duration=self.duration)
+        self.nframes += 1
+
+    def close(self):
+        if not self.fp.closed:
+            self.fp.write(b';')
+            self.fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+class DeltaGifWriter(GifWriter):
+    """
+    Streaming animated GIF writer that stores only what changed between frames:
+
+    fp_out - output filename
+    duration - display time of each frame in milliseconds
+    loop - number of loops (0 = forever)
+
+    One frame is held back so that its duration can be extended while the
+    following frames are identical to it.
+    """
+
+    def __init__(self, fp_out, duration=200, loop=0):
+
+        GifWriter.__init__(self, fp_out, duration=duration, loop=loop)
+        self.previous = None
+        self.pending = None
+
+    def _flush(self):
+        if self.pending is not None:
+            image, offset, mask, duration = self.pending
+            self._write_frame(image, offset=offset, mask=mask, duration=duration, disposal=1)
+            self.pending = None
+
+    def append(self, image):
+        """
+        image - PIL image of the next frame (must match the size of the first)
+        """
+        image = image.convert('RGB')
+        pixels = np.asarray(image)
+        if self.size is None:
+            self._write_header(image.size)
+            self.pending = (image, (0, 0), None, self.duration)
+        elif image.size != self.size:
+            raise ValueError('frame size ' + str(image.size) + ' does not match ' + str(self.size))
+        else:
+            changed = np.any(pixels != self.previous, axis=2)
+            rows = np.flatnonzero(changed.any(axis=1))
+            if len(rows) == 0:
+                image_, offset, mask, duration = self.pending
+                self.pending = (image_, offset, mask, duration + self.duration)
+                self.nframes += 1
+                return
+            cols = np.flatnonzero(changed.any(axis=0))
+            y0, y1, x0, x1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+            self._flush()
+            self.pending = (image.crop((x0, y0, x1, y1)), (int(x0), int(y0)), changed[y0:y1, x0:x1], self.duration)
+        self.previous = pixels
+        self.nframes += 1
+
+    def close(self):
+        if not self.fp.closed:
+            self._flush()
+        GifWriter.close(self)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+class Mp4Writer(object):
+    """
+    Streaming MP4 writer (H.264 via imageio-ffmpeg). Frames keep their size
+    (imageio would otherwise resize them to multiples of 16); yuv420p needs
+    even dimensions, so an odd width or height is padded by one edge pixel.
+
+    fp_out - output filename
+    duration - display time of each frame in milliseconds
+    """
+
+    def __init__(self, fp_out, duration=200):
+
+        import imageio
+
+        self.fp_out = fp_out
+        self.nframes = 0
+        self.writer = imageio.get_writer(fp_out, format='FFMPEG', mode='I', fps=1000.0/duration, codec='libx264', pixelformat='yuv420p', macro_block_size=1)
+
+    def append(self, image):
+        """
+        image - PIL image of the next frame
+        """
+        pixels = np.asarray(image.convert('RGB'))
+        pad = (pixels.shape[0] % 2, pixels.shape[1] % 2)
+        if any(pad):
+            pixels = np.pad(pixels, ((0, pad[0]), (0, pad[1]), (0, 0)), mode='edge')
+        self.writer.append_data(pixels)
+        self.nframes += 1
+
+    def close(self):
+        self.writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def open_writer(fp_out, duration=200, loop=0, delta=False):
+    """
+    fp_out - output filename: .gif or .mp4
+    duration - display time of each frame in milliseconds
+    loop - number of loops for GIF output (0 = forever)
+    delta - GIF only: write just the changed rectangle of each frame
+    returns - streaming writer with append(image) and close()
+    """
+
+    if fp_out.lower().endswith('.gif'):
+        if delta:
+            return DeltaGifWriter(fp_out, duration=duration, loop=loop)
+        return GifWriter(fp_out, duration=duration, loop=loop)
+    elif fp_out.lower().endswith('.mp4'):
+        return Mp4Writer(fp_out, duration=duration)
+    raise ValueError('unsupported output format: ' + fp_out)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def iter_png_frames(pattern):
+    """
+    pattern - glob pattern of PNG frames
+    returns - generator of PIL images in filename order, opened one at a time
+    """
+
+    for f in sorted(glob.glob(pattern)):
+        with Image.open(f) as image:
+            image.load()
+            yield image
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def iter_image_bytes(chunks):
+    """
+    chunks - iterable of encoded image bytes (e.g. PNG from fig.to_image)
+    returns - generator of decoded PIL images
+    """
+
+    for chunk in chunks:
+        with Image.open(io.BytesIO(chunk)) as image:
+            image.load()
+            yield image
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def encode(frames, fp_out, duration=200, loop=0, delta=False):
+    """
+    frames - iterable of PIL images
+    fp_out - output filename: .gif or .mp4
+    duration - display time of each frame in milliseconds
+    loop - number of loops for GIF output (0 = forever)
+    delta - GIF only: write just the changed rectangle of each frame
+    returns - number of frames appended
+    """
+
+    with open_writer(fp_out, duration=duration, loop=loop, delta=delta) as writer:
+        for image in frames:
+            writer.append(image)
+        return writer.nframes
+#-----------------------------------------------------------------------
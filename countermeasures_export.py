@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+#-----------------------------------------------------------------------
+# PROGRAM: countermeasures_export.py
+#-----------------------------------------------------------------------
+# Version 0.1
+# 17 October, 2026
+# Dr Michael Taylor
+# https://patternizer.github.io
+# patternizer AT gmail DOT com
+#-----------------------------------------------------------------------
+
+import os
+import json
+import argparse
+import itertools
+
+import plotly.io as pio
+
+from countermeasures_data import atomic_write, current_dataset
+from countermeasures_figure import colormaps, map_figure, bounded_map
+
+#-----------------------------------------------------------------------
+# Batch static export
+#-----------------------------------------------------------------------
+"""
+Writes the app's map for every combination of dates x projections x
+colormaps as standalone HTML, plotly JSON and / or PNG, e.g.
+
+    $ python countermeasures_export.py --dates 2020-03-01:2020-04-30 --projections "natural earth,mollweide" --colormaps all --formats html,json,png --workers 0
+
+Outputs go to <out>/<projection>/<colormap>/countermeasures_<date>.<format>.
+
+Figures come from the shared map template of countermeasures_figure, built
+once per (projection, colormap); each date only fills in its two z arrays and
+title. Figures are written by a process pool with at most 2 x workers in flight, so
+memory does not grow with the number of outputs. Every file is written
+atomically and existing outputs are skipped, so an interrupted run can simply
+be started again (--force rewrites them). PNG export needs kaleido.
+"""
+
+formats = ('html', 'json', 'png')
+
+#-----------------------------------------------------------------------
+def parse_dates(spec, datelist):
+    """
+    spec - comma separated dates and inclusive ranges 'start:end' (either end may be omitted), or None for all
+    datelist - available 'YYYY-MM-DD' dates in order
+    returns - selected dates in order, without duplicates
+    """
+
+    if not spec:
+        return list(datelist)
+    selected = set()
+    for item in spec.split(','):
+        item = item.strip()
+        if ':' in item:
+            start, end = item.split(':', 1)
+            selected.update(d for d in datelist if (not start or d >= start) and (not end or d <= end))
+        elif item in datelist:
+            selected.add(item)
+        else:
+            raise ValueError('date not in dataset: ' + item)
+    return [d for d in datelist if d in selected]
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def output_path(out_dir, date, projection, colors, fmt):
+    """
+    returns - <out_dir>/<projection>/<colors>/countermeasures_<date>.<fmt>
+    """
+
+    return os.path.join(out_dir, projection.replace(' ', '_'), colors, 'countermeasures_' + date + '.' + fmt)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def export_figure(task):
+    """
+    task - (date, projection, colors, list of (format, path))
+    returns - number of files written
+    """
+
+    date, projection, colors, outputs = task
+    spec = map_figure(current_dataset(), date, colors, projection)
+    for fmt, path in outputs:
+        if fmt == 'json':
+            data = json.dumps(spec, separators=(',', ':')).encode('utf-8')
+        elif fmt == 'html':
+            data = pio.to_html(spec, include_plotlyjs='cdn', full_html=True, validate=False).encode('utf-8')
+        else:
+            data = pio.to_image(spec, format=fmt, validate=False)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, data)
+    return len(outputs)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def pending_tasks(dates, projections, colors, fmts, out_dir, force=False):
+    """
+    returns - generator of export_figure() tasks for every combination with at
+    least one output missing (all of them with force)
+    """
+
+    for projection, c, date in itertools.product(projections, colors, dates):
+        outputs = [(fmt, output_path(out_dir, date, projection, c, fmt)) for fmt in fmts]
+        if not force:
+            outputs = [(fmt, path) for fmt, path in outputs if not os.path.exists(path)]
+        if outputs:
+            yield (date, projection, c, outputs)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def export(tasks, workers=1):
+    """
+    tasks - iterable of export_figure() tasks
+    workers - number of processes (1 = export in this process)
+    returns - number of files written; at most 2 x workers tasks are in flight
+    """
+
+    return sum(bounded_map(export_figure, tasks, workers))
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def main():
+
+    parser = argparse.ArgumentParser(description='Export the daily countermeasures map as static HTML / JSON / PNG files')
+    parser.add_argument('--dates', default=None,
+                        help='comma separated dates or inclusive ranges START:END (default: every date)')
+    parser.add_argument('--projections', default='natural earth',
+                        help='comma separated plotly geo projections (default: natural earth)')
+    parser.add_argument('--colormaps', default='Shikari',
+                        help='comma separated colormaps, or all: ' + ', '.join(colormaps) + ' (default: Shikari)')
+    parser.add_argument('--formats', default='html,json',
+                        help='comma separated output formats: ' + ', '.join(formats) + ' (default: html,json)')
+    parser.add_argument('-o', '--out', default='export', help='output directory (default: export)')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of export processes (0 = one per CPU core, default 1)')
+    parser.add_argument('-f', '--force', action='store_true', help='rewrite outputs that already exist')
+    args = parser.parse_args()
+
+    try:
+        dates = parse_dates(args.dates, current_dataset().datelist)
+    except ValueError as e:
+        parser.error(str(e))
+    projections = [p.strip() for p in args.projections.split(',')]
+    colors = list(colormaps) if args.colormaps == 'all' else [c.strip() for c in args.colormaps.split(',')]
+    fmts = [f.strip() for f in args.formats.split(',')]
+    for c in colors:
+        if c not in colormaps:
+            parser.error('unknown colormap: ' + c)
+    for fmt in fmts:
+        if fmt not in formats:
+            parser.error('unknown format: ' + fmt)
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+
+    total = len(dates) * len(projections) * len(colors) * len(fmts)
+    written = export(pending_tasks(dates, projections, colors, fmts, args.out, args.force), workers)
+    print('** wrote ' + str(written) + ' files, ' + str(total - written) + ' of ' + str(total) + ' already present')
+#-----------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
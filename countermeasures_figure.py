@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+
+#-----------------------------------------------------------------------
+# PROGRAM: countermeasures_figure.py
+#-----------------------------------------------------------------------
+# Version 0.1
+# 17 October, 2026
+# Dr Michael Taylor
+# https://patternizer.github.io
+# patternizer AT gmail DOT com
+#-----------------------------------------------------------------------
+
+import json
+import hashlib
+import numpy as np
+import plotly.colors
+import plotly.graph_objects as go
+import plotly.io as pio
+from functools import lru_cache
+from contextlib import nullcontext
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from countermeasures_data import countermeasures
+
+#-----------------------------------------------------------------------
+# Shared rendering core
+#-----------------------------------------------------------------------
+"""
+Levels, colormaps and the choropleth used by the app, the video job and the
+batch tools. Importing this module does no I/O: data is loaded
+on first use through countermeasures_data.current_dataset().
+
+map_template() builds the figure for a (snapshot, colormap, projection, style)
+once through plotly, validated and serialized to a plain dict with the z
+arrays left out. map_figure() then only fills in the z arrays and the title
+for a date, so a figure costs a column lookup instead of a plotly
+object build. Templates are shared: treat returned dicts as read-only.
+Both take an optional stages histogram (see countermeasures_metrics) that
+times the colorscale, traces and template stages when a template is actually
+built, and the figure stage of every map.
+
+The level scale, traces and locationmode come from the DatasetSource of the
+snapshot: the bundled dataset is drawn as a USA-states and an ISO-3 trace,
+other datasets as one trace of their own locationmode (with their geojson
+outlines for 'geojson-id').
+"""
+
+#-----------------------------------------------------------------------
+def discrete_colorscale(values, colors):
+    """
+    values - categorical values
+    colors - rgb or hex colorcodes for len(values)-1
+    returns - plotly  discrete colorscale, tickvals, ticktext
+    """
+
+    if len(values) != len(colors)+1:
+        raise ValueError('len(values) should be = len(colors)+1')
+    values = sorted(values)
+    nvalues = [(v-values[0])/(values[-1]-values[0]) for v in values]  #normalized values
+    colorscale = []
+    for k in range(len(colors)):
+        colorscale.extend([[nvalues[k], colors[k]], [nvalues[k+1], colors[k]]])
+    tickvals = [((values[k]+values[k+1])/2.0) for k in range(len(values)-1)]
+    ticktext = [f'{int(values[k])}' for k in range(len(values)-1)]
+    return colorscale, tickvals, ticktext
+#-----------------------------------------------------------------------
+
+# Levels of the bundled dataset (other datasets carry their own, see DatasetSource)
+nlabels = len(countermeasures)
+
+# Colormaps offered by the radio buttons
+colormaps = {
+'Viridis': plotly.colors.sequential.Viridis_r,
+'Cividis': plotly.colors.sequential.Cividis_r,
+'Plotly3': plotly.colors.sequential.Plotly3_r,
+'Magma': plotly.colors.sequential.Magma_r,
+#'Shikari': ['#d8d7d5','#a1dcfc','#fdee03','#75b82b','#a84190','#0169b3'],
+'Shikari': ['#2f2f2f','#a1dcfc','#fdee03','#75b82b','#a84190','#0169b3'],
+}
+
+# Layout differences between the app map and the video frames
+styles = {
+'app': dict(title_y=0.95, credit_y=-0.05),
+'video': dict(title_y=0.9, credit_y=0.0),
+}
+
+credit = 'Data: <a href="https://github.com/OlivierLej/Coronavirus_CounterMeasures">Olivier Lejeune</a>, Visualisation: <a href="https://patternizer.github.io">Michael Taylor</a>'
+
+#-----------------------------------------------------------------------
+def level_colors(colors, nlevels=nlabels):
+    """
+    colors - name of a colormap in colormaps
+    nlevels - number of levels
+    returns - list of nlevels colours, one per level
+    """
+
+    cmap = colormaps[colors]
+    cmap_idx = np.linspace(0,len(cmap)-1, nlevels, dtype=int)
+    return [cmap[i] for i in cmap_idx]
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+@lru_cache(maxsize=None)
+def make_colorscale(colors, nlevels=nlabels):
+    """
+    colors - name of a colormap in colormaps
+    nlevels - number of levels
+    returns - plotly discrete colorscale, tickvals, ticktext for nlevels levels
+    """
+
+    colors = level_colors(colors, nlevels)
+    values = np.array(np.arange(len(colors)+1))
+    return discrete_colorscale(values, colors)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def title_text(date):
+    """
+    date - 'YYYY-MM-DD'
+    returns - map title for date
+    """
+
+    return 'Coronavirus counter-measures: ' + date
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def timed(stages, stage):
+    """
+    stages - Histogram labelled by stage, or None
+    returns - context manager observing the with block as stage (no-op without stages)
+    """
+
+    return stages.time(stage=stage) if stages is not None else nullcontext()
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def map_template(snapshot, colors, projection='natural earth', style='app', stages=None):
+    """
+    snapshot - Dataset
+    colors - name of a colormap in colormaps
+    projection - plotly geo projection_type
+    style - key of styles
+    stages - Histogram timing the build stages on a cache miss (optional)
+    returns - figure dict of the map without z arrays or title text, built
+    once per snapshot (kept in its DerivedCache)
+    """
+
+    return snapshot.derived.get('template', (colors, projection, style),
+        lambda: build_template(snapshot, colors, projection, style, stages), 64)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def template_hash(snapshot, projection='natural earth', style='app', stages=None):
+    """
+    snapshot - Dataset
+    projection - plotly geo projection_type
+    style - key of styles
+    stages - Histogram timing the templates it builds (optional)
+    returns - sha1 of map_template() for every colormap: changes whenever the
+    layout, colorscales, styles or credit of the rendered maps do
+    """
+
+    def build():
+        specs = [map_template(snapshot, colors, projection, style, stages) for colors in sorted(colormaps)]
+        return hashlib.sha1(json.dumps(specs, sort_keys=True).encode('utf-8')).hexdigest()
+
+    return snapshot.derived.get('template_hash', (projection, style), build, 8)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def build_template(snapshot, colors, projection, style, stages=None):
+    """
+    returns - map_template() built through plotly
+    """
+
+    source = snapshot.source
+    with timed(stages, 'colorscale'):
+        colorscale, tickvals, ticktext = make_colorscale(colors, source.nlevels)
+    with timed(stages, 'traces'):
+        traces = snapshot.traces()
+    country_id = snapshot.country_id
+    country_name = snapshot.country_name
+    title_y = styles[style]['title_y']
+    credit_y = styles[style]['credit_y']
+
+#    projections_all = ['equirectangular', 'mercator', 'orthographic', 'natural earth', 'kavrayskiy7', 'miller', 'robinson', 'eckert4', 'azimuthal equal area', 'azimuthal equidistant', 'conic equal area', 'conic conformal', 'conic equidistant', 'gnomonic', 'stereographic', 'mollweide', 'hammer', 'transverse mercator', 'albers usa', 'winkel tripel', 'aitoff', 'sinusoidal']
+#    projections_sub = ['equirectangular', 'natural earth', 'eckert4', 'mollweide', 'albers usa', 'sinusoidal']
+
+    with timed(stages, 'template'):
+        outlines = dict(geojson=source.geojson, featureidkey=source.featureidkey) if source.locationmode == 'geojson-id' else {}
+        data = [
+
+        go.Choropleth(
+                locations = country_id[rows],
+                text = country_name[rows],
+                zmin = 0,
+                zmax = source.nlevels,
+                locationmode=locationmode,
+                colorscale = colorscale,
+                colorbar = dict(thickness=15, tickvals=tickvals, ticktext=ticktext),
+                reversescale=False,
+                marker_line_color='darkgray',
+                marker_line_width=0.5,
+                colorbar_tickprefix = '',
+                colorbar_title = 'Level',
+                **outlines)
+
+        for rows, locationmode in traces]
+
+        layout = go.Layout(
+
+        title={
+            'x':0.46,
+            'y':title_y,
+            'xanchor': 'center',
+            'yanchor': 'top',
+        },
+        geo=dict(
+            scope = 'world',
+            showframe = True,
+            showcoastlines = True,
+            projection_type = projection,
+        ),
+        annotations = [dict(
+            text = credit,
+            x = 0.5,
+            y = credit_y,
+            xanchor = 'center',
+            yanchor = 'bottom',
+            showarrow = False,
+            )
+        ],
+        margin=dict(r=0, l=0, b=40, t=40),
+        )
+
+        template = json.loads(pio.to_json(go.Figure(data=data, layout=layout), validate=False))
+        if outlines:
+            # set after validation: geo.fitbounds is newer than the pinned plotly
+            template['layout']['geo']['fitbounds'] = 'locations'
+    return template
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def map_figure(snapshot, date, colors, projection='natural earth', style='app', stages=None):
+    """
+    snapshot - Dataset
+    date - 'YYYY-MM-DD'
+    colors - name of a colormap in colormaps
+    projection - plotly geo projection_type
+    style - key of styles
+    stages - Histogram timing the template build (on a miss) and the figure stage (optional)
+    returns - figure dict of the map on date (shares all but z and title with map_template())
+    """
+
+    spec = map_template(snapshot, colors, projection, style, stages)
+    with timed(stages, 'figure'):
+        column = snapshot.column(date)
+        z = [column[rows].tolist() for rows, locationmode in snapshot.traces()]
+        return {
+            'data': [dict(trace, z=z[i]) for i, trace in enumerate(spec['data'])],
+            'layout': dict(spec['layout'], title=dict(spec['layout']['title'], text=title_text(date))),
+        }
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+# Batch rendering
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def bounded_map(function, tasks, workers=1, initializer=None):
+    """
+    function - picklable function of one task (e.g. rendering one map)
+    tasks - iterable of tasks, consumed lazily
+    workers - number of processes (1 = run in this process)
+    initializer - called once in each worker process
+    returns - generator of function(task) in task order; at most 2 x workers
+    tasks are in flight so memory stays bounded
+    """
+
+    if workers <= 1:
+        for task in tasks:
+            yield function(task)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(function, task))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+#-----------------------------------------------------------------------
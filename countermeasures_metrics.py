@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+#-----------------------------------------------------------------------
+# PROGRAM: countermeasures_metrics.py
+#-----------------------------------------------------------------------
+# Version 0.1
+# 17 October, 2026
+# Dr Michael Taylor
+# https://patternizer.github.io
+# patternizer AT gmail DOT com
+#-----------------------------------------------------------------------
+
+import os
+import time
+import pstats
+import itertools
+import cProfile
+import threading
+from functools import wraps
+from contextlib import contextmanager
+
+#-----------------------------------------------------------------------
+# Metrics
+#-----------------------------------------------------------------------
+"""
+Minimal in-process metrics in the Prometheus text exposition format, so the
+Dash server can be scraped without extra dependencies:
+
+Histogram - latency histogram with labels (cumulative buckets, sum, count)
+Gauge - value(s) read from a callable at scrape time
+render() - text of every registered metric for a /metrics route
+
+Metrics are per process: with several gunicorn workers each one reports its
+own and the scraper (or a per-worker port) is expected to aggregate them.
+
+SlowRequestProfiler runs cProfile around a request and keeps the profile if
+the request took longer than a threshold. Only one profiler can be active in
+a process, so concurrent requests are profiled one at a time and the rest
+run unprofiled.
+"""
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+registry = []
+
+#-----------------------------------------------------------------------
+def format_labels(labelnames, values, extra=()):
+    """
+    labelnames - label names
+    values - label values in the same order
+    extra - further (name, value) pairs
+    returns - '{name="value",...}' or '' if there are no labels
+    """
+
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escape = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(n + '="' + escape(v) + '"' for n, v in pairs) + '}'
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+class Histogram(object):
+    """
+    Thread-safe latency histogram:
+
+    name - metric name (seconds by convention)
+    documentation - HELP text
+    labelnames - names of the labels passed to observe() / time()
+    buckets - upper bounds of the buckets in seconds (+Inf is implicit)
+    """
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, **labels):
+        """
+        value - observed duration in seconds
+        labels - one value per label name
+        """
+        key = tuple(str(labels[n]) for n in self.labelnames)
+        with self.lock:
+            counts = self.series.get(key)
+            if counts is None:
+                counts = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observes the wall time of the with block.
+        """
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def timed(self, **labels):
+        """
+        returns - decorator observing the wall time of every call
+        """
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.time(**labels):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def collect(self):
+        """
+        returns - exposition lines of the histogram
+        """
+        lines = ['# HELP ' + self.name + ' ' + self.documentation, '# TYPE ' + self.name + ' histogram']
+        with self.lock:
+            series = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self.series.items())
+        for key, (buckets, total, count) in series:
+            for bound, n in zip(self.buckets, buckets):
+                lines.append(self.name + '_bucket' + format_labels(self.labelnames, key, [('le', repr(bound))]) + ' ' + str(n))
+            lines.append(self.name + '_bucket' + format_labels(self.labelnames, key, [('le', '+Inf')]) + ' ' + str(count))
+            lines.append(self.name + '_sum' + format_labels(self.labelnames, key) + ' ' + repr(total))
+            lines.append(self.name + '_count' + format_labels(self.labelnames, key) + ' ' + str(count))
+        return lines
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+class Gauge(object):
+    """
+    Gauge read at scrape time:
+
+    name - metric name
+    documentation - HELP text
+    labelnames - label names
+    read - callable returning a dict of label value tuple --> number
+    metric_type - 'gauge' or 'counter'
+    """
+
+    def __init__(self, name, documentation, labelnames, read, metric_type='gauge'):
+
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.read = read
+        self.metric_type = metric_type
+        registry.append(self)
+
+    def collect(self):
+        """
+        returns - exposition lines of the gauge
+        """
+        lines = ['# HELP ' + self.name + ' ' + self.documentation, '# TYPE ' + self.name + ' ' + self.metric_type]
+        for key, value in sorted(self.read().items()):
+            lines.append(self.name + format_labels(self.labelnames, key) + ' ' + repr(float(value)))
+        return lines
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def render():
+    """
+    returns - every registered metric in the Prometheus text format
+    """
+
+    lines = []
+    for metric in registry:
+        try:
+            lines.extend(metric.collect())
+        except Exception as e:
+            lines.append('# ' + metric.name + ' unavailable: ' + str(e))
+    return '\n'.join(lines) + '\n'
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+class SlowRequestProfiler(object):
+    """
+    Keeps a cProfile dump of requests slower than a threshold:
+
+    threshold - seconds
+    output_dir - directory for the .prof files (view with snakeviz, or
+                 flameprof / gprof2dot for a flamegraph)
+    """
+
+    def __init__(self, threshold, output_dir):
+
+        self.threshold = threshold
+        self.output_dir = output_dir
+        self.busy = threading.Lock()
+        self.sequence = itertools.count()
+        os.makedirs(output_dir, exist_ok=True)
+
+    def start(self):
+        """
+        returns - (profiler, start time), profiler is None if another request is being profiled
+        """
+        if not self.busy.acquire(blocking=False):
+            return (None, time.perf_counter())
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            self.busy.release()
+            return (None, time.perf_counter())
+        return (profiler, time.perf_counter())
+
+    def stop(self, state, name):
+        """
+        state - value returned by start()
+        name - label of the request, used in the file name
+        returns - path of the dump if the request was slow, else None
+        """
+        profiler, t0 = state
+        if profiler is None:
+            return None
+        profiler.disable()
+        self.busy.release()
+        elapsed = time.perf_counter() - t0
+        if elapsed < self.threshold:
+            return None
+        safe = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name).strip('_') or 'request'
+        path = os.path.join(self.output_dir, time.strftime('%Y%m%dT%H%M%S') + '_' + str(next(self.sequence)) + '_' + str(int(elapsed * 1000)) + 'ms_' + safe + '.prof')
+        pstats.Stats(profiler).dump_stats(path)
+        return path
+#-----------------------------------------------------------------------
@@ -0,0 +1,274 @@
+# -*- coding: utf-8 -*-
+
+#-----------------------------------------------------------------------
+# PROGRAM: countermeasures_precompute.py
+#-----------------------------------------------------------------------
+# Version 0.1
+# 17 October, 2026
+# Dr Michael Taylor
+# https://patternizer.github.io
+# patternizer AT gmail DOT com
+#-----------------------------------------------------------------------
+
+import os
+import time
+import shutil
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from countermeasures_data import atomic_write, current_dataset
+
+#-----------------------------------------------------------------------
+# Precomputed figure cache
+#-----------------------------------------------------------------------
+"""
+After each data refresh every (date, colormap) map, the animation of each
+colormap and the timeline aggregates are built once, in the background, and
+written to a directory shared by all server processes:
+
+    <root>/<source key>/<figure version>/<kind>/<key>.json
+
+The source key names the dataset and hashes its legend and locationmode, and
+the figure version (the app's figure_version()) hashes the data together
+with the rendered templates and rendering code, so every gunicorn worker
+that has loaded the same data and runs the same code reads the same entries,
+whichever worker produced them. A new data version or a deploy that changes
+the figures gets a new directory instead of reading stale entries. Each worker still keeps
+its own in-memory LRU in front of the directory.
+
+Only one process builds a version: the first to create its .lock file
+(locks older than lock_timeout seconds are taken over, in case the builder
+died). Entries already on disk are skipped, so an interrupted run resumes
+where it stopped, and a 'complete' marker is written at the end. All but the
+newest keep_versions versions of the source are removed afterwards.
+
+The app runs this after every refresh when COUNTERMEASURES_PRECOMPUTE_DIR is
+set; it can also be run on its own, e.g. from the job that fetches the data:
+
+    $ python countermeasures_precompute.py --dir .cache/precompute --workers 4 --frames 7
+
+Only the command renders video frames (--frames): they go through the frame
+manifest of countermeasures_video.py, so its next run only encodes. Frame
+rendering starts worker processes and writes PNGs and the manifest to the
+current directory, which is not safe from a thread of a gunicorn worker, so
+the app never does it.
+"""
+
+lock_timeout = 3600
+keep_versions = 2
+
+#-----------------------------------------------------------------------
+class DiskCache(object):
+    """
+    Serialized figures on disk, keyed by dataset source and figure version:
+
+    root - cache directory
+    version - function of a Dataset returning the version of its figures
+              (default: the data version only)
+    """
+
+    def __init__(self, root, version=None):
+
+        self.root = root
+        self.version = version or (lambda snapshot: snapshot.version)
+
+    def directory(self, snapshot):
+        """
+        snapshot - Dataset
+        returns - directory of the entries of snapshot
+        """
+        return os.path.join(self.root, snapshot.source.key, self.version(snapshot))
+
+    def path(self, snapshot, kind, key):
+        """
+        returns - filename of the entry
+        """
+        return os.path.join(self.directory(snapshot), kind, key + '.json')
+
+    def get(self, snapshot, kind, key):
+        """
+        snapshot - Dataset
+        kind - 'figure', 'animation', 'timeline', ...
+        key - entry name within kind (may contain '/')
+        returns - the stored text, or None if it has not been built yet
+        """
+        try:
+            with open(self.path(snapshot, kind, key), encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def put(self, snapshot, kind, key, text):
+        """
+        text - serialized figure, written atomically
+        """
+        path = self.path(snapshot, kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        atomic_write(path, text.encode('utf-8'))
+
+    def claim(self, snapshot):
+        """
+        returns - True if this process may build snapshot (it created the lock)
+        """
+        lock = os.path.join(self.directory(snapshot), '.lock')
+        os.makedirs(os.path.dirname(lock), exist_ok=True)
+        try:
+            if time.time() - os.path.getmtime(lock) > lock_timeout:
+                os.remove(lock)
+        except OSError:
+            pass
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            return False
+
+    def release(self, snapshot, complete=True):
+        """
+        complete - write the 'complete' marker before releasing the lock
+        """
+        directory = self.directory(snapshot)
+        if complete:
+            atomic_write(os.path.join(directory, 'complete'), time.strftime('%Y-%m-%dT%H:%M:%S').encode('utf-8'))
+        try:
+            os.remove(os.path.join(directory, '.lock'))
+        except OSError:
+            pass
+
+    def is_complete(self, snapshot):
+        return os.path.exists(os.path.join(self.directory(snapshot), 'complete'))
+
+    def prune(self, snapshot):
+        """
+        snapshot - Dataset whose version must survive, in addition to the
+                   newest keep_versions versions of its source
+        returns - list of removed versions
+        """
+        parent = os.path.dirname(self.directory(snapshot))
+        versions = [v for v in os.listdir(parent) if os.path.isdir(os.path.join(parent, v))]
+        versions.sort(key=lambda v: os.path.getmtime(os.path.join(parent, v)), reverse=True)
+        removed = [v for v in versions[keep_versions:] if v != self.version(snapshot)]
+        for v in removed:
+            shutil.rmtree(os.path.join(parent, v), ignore_errors=True)
+        return removed
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def precompute(cache, snapshot, tasks, workers=2):
+    """
+    cache - DiskCache
+    snapshot - Dataset the tasks build
+    tasks - iterable of (kind, key, callable returning the serialized entry)
+    workers - number of threads
+    returns - number of entries written (entries already on disk are skipped)
+    """
+
+    def run(task):
+        kind, key, build = task
+        if os.path.exists(cache.path(snapshot, kind, key)):
+            return 0
+        cache.put(snapshot, kind, key, build())
+        return 1
+
+    if workers <= 1:
+        return sum(run(task) for task in tasks)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(run, tasks))
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def precompute_frames(n, workers=1):
+    """
+    n - number of newest dates of the current dataset to render
+    workers - number of rendering processes
+    returns - number of frames rendered (frames already up to date are skipped)
+    """
+
+    import countermeasures_video as video
+    video.settings_hash.cache_clear()
+    manifest = video.load_manifest()
+    dates = video.frame_dates()[-n:]
+    rendered = 0
+    for projection in video.projections:
+        stale = video.stale_frames(dates, projection, manifest)
+        for date, filename in zip(stale, video.render_frames(list(stale), projection, workers)):
+            manifest[filename] = stale[date]
+        rendered += len(stale)
+    video.save_manifest(manifest)
+    return rendered
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def run_precompute(cache, snapshot, tasks, workers=2, frames=0):
+    """
+    cache - DiskCache
+    snapshot - Dataset the tasks build
+    tasks - iterable of precompute() tasks
+    workers - number of threads (and frame rendering processes)
+    frames - number of newest video frames to render (only if snapshot is the
+             current dataset; only from the command, see above)
+    returns - number of entries written, or None if another process holds the version
+    """
+
+    if not cache.claim(snapshot):
+        return None
+    complete = False
+    try:
+        t0 = time.perf_counter()
+        written = precompute(cache, snapshot, tasks, workers)
+        if frames > 0 and snapshot is current_dataset():
+            try:
+                written += precompute_frames(frames, workers)
+            except Exception as e:
+                print('** WARNING: video frames not rendered (' + str(e) + ')')
+        complete = True
+        print('** precomputed ' + str(written) + ' entries for ' + snapshot.source.name + ' ' + cache.version(snapshot) + ' in ' + f'{time.perf_counter() - t0:.1f}' + ' s')
+    finally:
+        cache.release(snapshot, complete)
+    cache.prune(snapshot)
+    return written
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def start_precompute(cache, snapshot, tasks, workers=2):
+    """
+    Runs run_precompute() in a daemon thread, without video frames.
+    returns - the thread
+    """
+
+    def work():
+        try:
+            run_precompute(cache, snapshot, tasks, workers)
+        except Exception as e:
+            print('** WARNING: precompute failed (' + str(e) + ')')
+
+    thread = threading.Thread(target=work, name='precompute')
+    thread.daemon = True
+    thread.start()
+    return thread
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def main():
+
+    parser = argparse.ArgumentParser(description='Build the app figures of the current dataset into the shared on-disk cache')
+    parser.add_argument('--dir', default=os.environ.get('COUNTERMEASURES_PRECOMPUTE_DIR', os.path.join('.cache', 'precompute')),
+                        help='cache directory (default: $COUNTERMEASURES_PRECOMPUTE_DIR, else .cache/precompute)')
+    parser.add_argument('-w', '--workers', type=int, default=2,
+                        help='number of threads / frame rendering processes (0 = one per CPU core, default 2)')
+    parser.add_argument('--frames', type=int, default=0,
+                        help='also render the N newest video frames (default 0)')
+    args = parser.parse_args()
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
+
+    import countermeasures_app as app
+    snapshot = current_dataset()
+    cache = DiskCache(args.dir, app.figure_version)
+    written = run_precompute(cache, snapshot, app.precompute_tasks(snapshot), workers, args.frames)
+    if written is None:
+        print('** ' + cache.version(snapshot) + ' is being precomputed by another process')
+#-----------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
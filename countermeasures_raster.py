@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+
+#-----------------------------------------------------------------------
+# PROGRAM: countermeasures_raster.py
+#-----------------------------------------------------------------------
+# Version 0.1
+# 17 October, 2026
+# Dr Michael Taylor
+# https://patternizer.github.io
+# patternizer AT gmail DOT com
+#-----------------------------------------------------------------------
+
+import os
+import json
+import numpy as np
+from PIL import Image, ImageDraw, ImageColor, ImageFont
+
+from countermeasures_data import fetch_cached
+
+#-----------------------------------------------------------------------
+# Native raster renderer
+#-----------------------------------------------------------------------
+"""
+Renders choropleth frames without a browser. The country and state outlines
+are projected and rasterized once into a label image in which each pixel
+holds the index of the region it belongs to (0 = static background). The
+frame for a day is then a single numpy gather: the level of every region is
+looked up in the colour table and scattered onto the region pixels of a
+pre-drawn base image carrying the frame, borders and legend.
+
+Geometry is read from a TopoJSON (objects 'countries' with ISO-3 ids and
+'subunits' with US state ids, as in the plotly.js world_110m.json) or a
+GeoJSON FeatureCollection whose feature ids match dataset.csv country_id.
+"""
+
+GEOMETRY_URL = r'https://cdn.plot.ly/world_110m.json'
+
+background_color = (255, 255, 255)
+land_color = (229, 236, 246)
+border_color = (169, 169, 169)
+text_color = (42, 63, 95)
+
+#-----------------------------------------------------------------------
+def load_geometry(source=None):
+    """
+    source - path or URL of a TopoJSON / GeoJSON file (default: $COUNTERMEASURES_GEOMETRY, else GEOMETRY_URL)
+    returns - list of (region id, polygons) where each polygon is a list of
+    rings (outer ring first) of (lon, lat) numpy arrays
+    """
+
+    source = source or os.environ.get('COUNTERMEASURES_GEOMETRY') or GEOMETRY_URL
+    if source.startswith('http://') or source.startswith('https://'):
+        source = fetch_cached(source, max_age=float('inf'))
+    with open(source) as f:
+        geometry = json.load(f)
+
+    if geometry.get('type') == 'Topology':
+        regions = []
+        for name in ('countries', 'subunits'):
+            if name in geometry['objects']:
+                regions.extend(topojson_features(geometry, name))
+        return regions
+    return [(feature.get('id'), geojson_polygons(feature['geometry'])) for feature in geometry['features'] if feature.get('geometry')]
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def topojson_features(topology, name):
+    """
+    topology - decoded TopoJSON
+    name - name of the object holding the geometries
+    returns - list of (id, polygons) as in load_geometry()
+    """
+
+    transform = topology.get('transform')
+    arcs = []
+    for arc in topology['arcs']:
+        a = np.array(arc, dtype=float)
+        if transform:
+            a = np.cumsum(a, axis=0) * transform['scale'] + transform['translate']
+        arcs.append(a)
+
+    def ring(indices):
+        points = []
+        for i in indices:
+            a = arcs[i] if i >= 0 else arcs[~i][::-1]
+            points.append(a if not points else a[1:])
+        return np.concatenate(points)
+
+    features = []
+    for geom in topology['objects'][name]['geometries']:
+        if geom.get('type') == 'Polygon':
+            polygons = [[ring(r) for r in geom['arcs']]]
+        elif geom.get('type') == 'MultiPolygon':
+            polygons = [[ring(r) for r in p] for p in geom['arcs']]
+        else:
+            continue
+        features.append((geom.get('id'), polygons))
+    return features
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def geojson_polygons(geometry):
+    """
+    geometry - GeoJSON Polygon or MultiPolygon
+    returns - polygons as in load_geometry()
+    """
+
+    if geometry['type'] == 'Polygon':
+        return [[np.array(r, dtype=float)[:, :2] for r in geometry['coordinates']]]
+    elif geometry['type'] == 'MultiPolygon':
+        return [[np.array(r, dtype=float)[:, :2] for r in p] for p in geometry['coordinates']]
+    return []
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def project(lon, lat, projection):
+    """
+    lon, lat - arrays in degrees
+    projection - 'natural earth' or 'equirectangular'
+    returns - projected x, y (unit sphere, y up)
+    """
+
+    lam = np.radians(lon)
+    phi = np.radians(lat)
+    if projection == 'equirectangular':
+        return lam, phi
+    elif projection == 'natural earth':
+        phi2 = phi * phi
+        phi4 = phi2 * phi2
+        x = lam * (0.8707 - 0.131979 * phi2 + phi4 * (-0.013791 + phi4 * (0.003971 * phi2 - 0.001529 * phi4)))
+        y = phi * (1.007226 + phi2 * (0.015085 + phi4 * (-0.044475 + 0.028874 * phi2 - 0.005916 * phi4)))
+        return x, y
+    raise ValueError('unsupported projection for the raster backend: ' + projection)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+class RasterRenderer(object):
+    """
+    Label-image choropleth renderer:
+
+    dataset - Dataset from countermeasures_data.parse_dataset()
+    colors - one colour per level (hex or 'rgb(r,g,b)'); higher levels use the last colour
+    projection - 'natural earth' or 'equirectangular'
+    geometry - output of load_geometry() (default: loaded from GEOMETRY_URL)
+    width, height - frame size in pixels
+    """
+
+    def __init__(self, dataset, colors, projection='natural earth', geometry=None, width=700, height=450):
+
+        self.dataset = dataset
+        self.width = width
+        self.height = height
+        self.font = ImageFont.load_default()
+
+        palette = [ImageColor.getrgb(c)[:3] for c in colors]
+        nlevels = max(int(dataset.levels.max()) + 1, len(palette))
+        self.level_rgb = np.array([palette[min(l, len(palette)-1)] for l in range(nlevels)], dtype=np.uint8)
+
+        if geometry is None:
+            geometry = load_geometry()
+        self._rasterize(geometry, projection, palette)
+
+    def _rasterize(self, geometry, projection, palette):
+        """
+        Draws the static base image and the region label image.
+        """
+        left, top, right, bottom = 10, 40, self.width - 90, self.height - 30
+
+        # Outline of the whole globe fixes the scale
+        edge = np.linspace(-90, 90, 181)
+        globe = np.column_stack([np.concatenate([np.full_like(edge, -180), np.full_like(edge, 180)]), np.concatenate([edge, edge[::-1]])])
+        sx, sy = project(globe[:, 0], globe[:, 1], projection)
+        scale = min((right - left) / (sx.max() - sx.min()), (bottom - top) / (sy.max() - sy.min()))
+        cx, cy = (left + right) / 2.0, (top + bottom) / 2.0
+
+        def to_pixels(ring):
+            x, y = project(ring[:, 0], ring[:, 1], projection)
+            return list(zip(cx + scale * x, cy - scale * y))
+
+        base = Image.new('RGB', (self.width, self.height), background_color)
+        label = Image.new('I', (self.width, self.height), 0)
+        draw_base = ImageDraw.Draw(base)
+        draw_label = ImageDraw.Draw(label)
+
+        draw_base.polygon(to_pixels(globe), fill=background_color, outline=border_color)
+
+        # Countries first, US states on top of them
+        row = {c: i for i, c in enumerate(self.dataset.country_id)}
+        regions = sorted(geometry, key=lambda g: len(g[0] or '') < 3)
+        for region_id, polygons in regions:
+            r = row.get(region_id)
+            for polygon in polygons:
+                outer = to_pixels(polygon[0])
+                if len(outer) < 3:
+                    continue
+                if r is None:
+                    draw_base.polygon(outer, fill=land_color)
+                    draw_label.polygon(outer, fill=0)
+                else:
+                    draw_label.polygon(outer, fill=r + 1)
+                for hole in polygon[1:]:
+                    if len(hole) >= 3:
+                        draw_label.polygon(to_pixels(hole), fill=0)
+                        draw_base.polygon(to_pixels(hole), fill=background_color)
+
+        # Borders are static pixels
+        for region_id, polygons in regions:
+            for polygon in polygons:
+                for ring in polygon:
+                    if len(ring) >= 2:
+                        points = to_pixels(ring)
+                        draw_base.line(points, fill=border_color, width=1)
+                        draw_label.line(points, fill=0, width=1)
+
+        # Legend
+        x0 = self.width - 70
+        draw_base.text((x0, top), 'Level', fill=text_color, font=self.font)
+        for level in range(len(palette)):
+            y0 = top + 20 + 22 * (len(palette) - 1 - level)
+            draw_base.rectangle([x0, y0, x0 + 15, y0 + 18], fill=tuple(palette[level]))
+            draw_base.text((x0 + 22, y0 + 3), str(level), fill=text_color, font=self.font)
+
+        labels = np.asarray(label, dtype=np.int32).ravel()
+        self.base = np.asarray(base, dtype=np.uint8).copy()
+        self.pixels = np.flatnonzero(labels)
+        self.pixel_region = labels[self.pixels] - 1
+
+    def render_array(self, date):
+        """
+        date - 'YYYY-MM-DD'
+        returns - (height, width, 3) uint8 frame without title
+        """
+        region_rgb = self.level_rgb[self.dataset.column(date)]
+        frame = self.base.copy()
+        frame.reshape(-1, 3)[self.pixels] = region_rgb[self.pixel_region]
+        return frame
+
+    def render(self, date):
+        """
+        date - 'YYYY-MM-DD'
+        returns - PIL image of the frame for date
+        """
+        image = Image.fromarray(self.render_array(date))
+        draw = ImageDraw.Draw(image)
+        title = 'Coronavirus counter-measures: ' + date
+        draw.text((self.width // 2 - 3 * len(title), 15), title, fill=text_color, font=self.font)
+        draw.text((10, self.height - 18), 'Data: Olivier Lejeune, Visualisation: Michael Taylor', fill=text_color, font=self.font)
+        return image
+#-----------------------------------------------------------------------
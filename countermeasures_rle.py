@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+#-----------------------------------------------------------------------
+# PROGRAM: countermeasures_rle.py
+#-----------------------------------------------------------------------
+# Version 0.1
+# 17 October, 2026
+# Dr Michael Taylor
+# https://patternizer.github.io
+# patternizer AT gmail DOT com
+#-----------------------------------------------------------------------
+
+import numpy as np
+
+#-----------------------------------------------------------------------
+# Run-length encoded time series
+#-----------------------------------------------------------------------
+"""
+Intervention levels change only a few times per region over the whole
+record, so each region is stored as its change points: the day offset at
+which a run of identical levels starts and the level of that run. Runs are
+kept in flat CSR arrays ordered by region then day:
+
+run_start[offsets[r]:offsets[r+1]] - first day of each run of region r
+run_level[offsets[r]:offsets[r+1]] - level of each run of region r
+
+plus two indexes built once from them:
+
+changed_regions[day_offsets[d]:day_offsets[d+1]] - regions whose level changes on day d
+changed_levels[day_offsets[d]:day_offsets[d+1]] - their new levels
+counts[d, level] - number of regions at each level on day d
+
+level(region, date) is a binary search over that region's runs, changed_on(),
+changes_since() and distribution() are slices, so memory grows with the number of changes
+rather than regions x days.
+"""
+
+#-----------------------------------------------------------------------
+class RunLengthStore(object):
+    """
+    Change-point representation of a Dataset:
+
+    dataset - Dataset from countermeasures_data (only read while building)
+    """
+
+    def __init__(self, dataset):
+
+        levels = dataset.levels
+        nregions, ndays = levels.shape
+        self.country_id = dataset.country_id
+        self.datelist = dataset.datelist
+        self.date_index = dataset.date_index
+        self.row = {c: i for i, c in enumerate(dataset.country_id)}
+
+        # Run starts: day 0 of every region and every day whose level differs from the day before
+        starts = np.ones((nregions, ndays), dtype=bool)
+        starts[:, 1:] = levels[:, 1:] != levels[:, :-1]
+        regions, days = np.nonzero(starts)
+        self.run_start = days.astype(np.int32)
+        self.run_level = np.asarray(levels[regions, days], dtype=np.int8)
+        self.offsets = np.searchsorted(regions, np.arange(nregions + 1)).astype(np.int64)
+        self._keys = regions.astype(np.int64) * ndays + days
+
+        # Day index of the regions that change level on each day
+        changed = days > 0
+        order = np.argsort(days[changed], kind='stable')
+        self.changed_regions = regions[changed][order].astype(np.int32)
+        self.changed_levels = self.run_level[changed][order]
+        self.day_offsets = np.searchsorted(days[changed][order], np.arange(ndays + 1)).astype(np.int64)
+
+        # Level distribution per day from +1 / -1 at every change
+        nlevels = int(levels.max()) + 1 if levels.size else 1
+        delta = np.zeros((ndays, nlevels), dtype=np.int32)
+        np.add.at(delta, (days, self.run_level), 1)
+        previous = np.concatenate([[0], np.asarray(self.run_level[:-1], dtype=np.intp)])
+        np.add.at(delta, (days[changed], previous[changed]), -1)
+        self.counts = np.cumsum(delta, axis=0)
+
+        for a in (self.run_start, self.run_level, self.offsets, self._keys, self.changed_regions, self.changed_levels, self.day_offsets, self.counts):
+            a.setflags(write=False)
+
+    def _day(self, date):
+        return self.date_index[date] if isinstance(date, str) else int(date)
+
+    def _region(self, region):
+        return self.row[region] if isinstance(region, str) else int(region)
+
+    def level(self, region, date):
+        """
+        region - country_id or row offset
+        date - 'YYYY-MM-DD' or day offset
+        returns - level of region on date
+        """
+        r = self._region(region)
+        lo, hi = self.offsets[r], self.offsets[r + 1]
+        i = lo + np.searchsorted(self.run_start[lo:hi], self._day(date), side='right') - 1
+        return int(self.run_level[i])
+
+    def column(self, date):
+        """
+        date - 'YYYY-MM-DD' or day offset
+        returns - int8 levels of every region on date
+        """
+        ndays = len(self.datelist)
+        keys = np.arange(len(self.offsets) - 1, dtype=np.int64) * ndays + self._day(date)
+        return self.run_level[np.searchsorted(self._keys, keys, side='right') - 1]
+
+    def changed_on(self, date):
+        """
+        date - 'YYYY-MM-DD' or day offset
+        returns - row offsets of the regions whose level changed on date
+        """
+        d = self._day(date)
+        return self.changed_regions[self.day_offsets[d]:self.day_offsets[d + 1]]
+
+    def changes_since(self, date):
+        """
+        date - 'YYYY-MM-DD' or day offset
+        returns - list of (country_id, 'YYYY-MM-DD', level) for every change after date, oldest first
+        """
+        start = self.day_offsets[self._day(date) + 1]
+        days = np.searchsorted(self.day_offsets, np.arange(start, len(self.changed_regions)), side='right') - 1
+        return [(self.country_id[r], self.datelist[d], int(l)) for r, d, l in
+                zip(self.changed_regions[start:], days, self.changed_levels[start:])]
+
+    def distribution(self, date):
+        """
+        date - 'YYYY-MM-DD' or day offset
+        returns - number of regions at each level on date
+        """
+        return self.counts[self._day(date)]
+
+    def transitions(self, region):
+        """
+        region - country_id or row offset
+        returns - list of ('YYYY-MM-DD', level) for the start of every run
+        """
+        r = self._region(region)
+        lo, hi = self.offsets[r], self.offsets[r + 1]
+        return [(self.datelist[d], int(l)) for d, l in zip(self.run_start[lo:hi], self.run_level[lo:hi])]
+
+    @property
+    def nbytes(self):
+        """
+        returns - memory held by the run and index arrays in bytes
+        """
+        return sum(a.nbytes for a in (self.run_start, self.run_level, self.offsets, self._keys,
+                                      self.changed_regions, self.changed_levels, self.day_offsets, self.counts))
+#-----------------------------------------------------------------------
@@ -10,199 +10,287 @@
 # patternizer AT gmail DOT com
 #-----------------------------------------------------------------------
          
-import numpy as np
-import pandas as pd
-import dash
-import dash_core_components as dcc
-import dash_html_components as html
-import dash_bootstrap_components as dbc
-from dash.dependencies import Input, Output, State
 import plotly.graph_objects as go
-import plotly.express as px
-
-import glob
-from PIL import Image
-
-#-----------------------------------------------------------------------
-def discrete_colorscale(values, colors):
-    """
-    values - categorical values
-    colors - rgb or hex colorcodes for len(values)-1
-    returns - plotly  discrete colorscale, tickvals, ticktext
-    """
-    
-    if len(values) != len(colors)+1:
-        raise ValueError('len(values) should be = len(colors)+1')
-    values = sorted(values)     
-    nvalues = [(v-values[0])/(values[-1]-values[0]) for v in values]  #normalized values
-    colorscale = []
-    for k in range(len(colors)):
-        colorscale.extend([[nvalues[k], colors[k]], [nvalues[k+1], colors[k]]])        
-    tickvals = [((values[k]+values[k+1])/2.0) for k in range(len(values)-1)] 
-    ticktext = [f'{int(values[k])}' for k in range(len(values)-1)]
-    return colorscale, tickvals, ticktext
-#-----------------------------------------------------------------------
-
-#-----------------------------------------------------------------------
-# Define dictionary of counter-measures and deduce colorscale
-#-----------------------------------------------------------------------
-countermeasures = {
-'0': 'No or few containment measures in place',
-'1': 'Ban on public gatherings, cancellation of major events and conferences',
-'2': 'Schools and universities closed (dates matched to those from Unesco https://en.unesco.org/themes/education-emergencies/coronavirus-school-closures',
-'3': 'Non-essential shops, restaurants and bars closed',
-'4': 'Night curfew / partial lockdown in place for broad population categories',
-'5': 'All-day lockdown / shelter-in-place government instruction (citizens allowed to venture come out for essential items',
-#'6': 'Harsh lockdown (citizens forbidden to leave home even to buy essential items)'
-}
-nlabels = len(countermeasures)
-#cmap = px.colors.sequential.Viridis_r
-#cmap = px.colors.sequential.Cividis_r
-#cmap = px.colors.sequential.Plotly3_r
-#cmap = px.colors.sequential.Magma_r
-#cmap = ['#d8d7d5','#a1dcfc','#fdee03','#75b82b','#a84190','#0169b3']
-cmap = ['#2f2f2f','#a1dcfc','#fdee03','#75b82b','#a84190','#0169b3']
-cmap_idx = np.linspace(0,len(cmap)-1, nlabels, dtype=int)
-colors = [cmap[i] for i in cmap_idx]
-values = np.array(np.arange(len(colors)+1))
-colorscale, tickvals, ticktext = discrete_colorscale(values, colors)
-#-----------------------------------------------------------------------
-
-# Import Coronavirus countermeasure data from Olivier Lejeune
-"""
-Daily updated Coronavirus containment measures taken by governments from 2020-01-23 to date
-Provided by Olivier Lejeune: http://www.olejeune.com/ at:
-https://github.com/OlivierLej/Coronavirus_CounterMeasures
-dataset.csv has structure: country_id, country_name, 20200123_date, ...  
-"""
+import plotly.io as pio
 
-url = r'https://raw.githubusercontent.com/OlivierLej/Coronavirus_CounterMeasures/master/dataset.csv'
-#url = r'https://raw.githubusercontent.com/patternizer/Coronavirus_CounterMeasures/master/dataset.csv'
-df = pd.read_csv(url)
-country_name = df.country_name
-country_id = df.country_id
+from countermeasures_data import current_dataset, atomic_write
+from countermeasures_figure import level_colors, map_template, map_figure, bounded_map
+from countermeasures_encoder import encode, iter_png_frames, iter_image_bytes
+from countermeasures_raster import RasterRenderer, load_geometry
 
-# Import FIPS codes
-"""
-USA data is at state level and uses the alpha-2 code FIPS convention.
-Country data uses the alpha-3 code FIPS convention.
-Extract alpha-2 codes for countries and re-populate dataframe country_id
-"""
+import os
+import json
+import hashlib
+import argparse
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
+
+# Colormap of the frames (see countermeasures_figure.colormaps)
+colormap = 'Shikari'
+colors = level_colors(colormap)
 
-fips = r'https://raw.githubusercontent.com/lukes/ISO-3166-Countries-with-Regional-Codes/master/all/all.csv'
-df_fips = pd.read_csv(fips)
-alpha_2_codes = df_fips['alpha-2']
-alpha_3_codes = df_fips['alpha-3']
-id_length = [len(country_id[i]) for i in range(0,len(country_id))]
-usa = [i for i in range(len(country_id)) if id_length[i] < 3]
-world = [i for i in range(len(country_id)) if id_length[i] > 2]
-   
 # Set date
-""" 
-Data is available from 2020-01-23 to 2020-07-30 
 """
-headers = df.columns
-for i in range(len(headers)-1):
-    
-    if i>1:   
-        
-        columnstr = headers[i][0:4] + '-' + headers[i][4:6] + '-' + headers[i][6:8]
-        df.rename(columns = {headers[i]:columnstr}, inplace = True) 
-
-timenow = pd.Timestamp.now().to_pydatetime()
-timestr = timenow.strftime('%Y-%m-%d')
-# date = str(timenow.year) + '-' + str("{:02}".format(timenow.month)) + '-' + str("{:02}".format(timenow.day))
-# Last entry to database: 2020-07-39' --> need to override timenow()
-date = '2020-07-30'
-country_status = df[date]
-datelist = df.columns[df.columns<=date]
-opts = [{'label' : i, 'value' : i} for i in datelist]
+Frames are rendered from 2020-01-23 up to the latest date in the data
+"""
+
+#-----------------------------------------------------------------------
+def frame_dates():
+    """
+    returns - list of 'YYYY-MM-DD' from the start of the record to the latest date
+    """
+
+    dataset = current_dataset()
+    return dataset.dates_to(dataset.latest)
+#-----------------------------------------------------------------------
 
 # PLOT WORLD STATUS FRAMES:
 """
-Loop through plotly world daily maps of country-level measures
+Plotly world daily maps of country-level measures. Only frames whose
+figure (levels, colorscale, projection, layout) changed since the last run
+are re-rendered: see countermeasures_frames.json. Frames are exported one
+per date, either sequentially or across a process pool (--workers N): each
+worker renders a blank figure once at start-up so that its image-export
+engine is already running when the first real frame arrives.
 """
 
 #projections_all = ['equirectangular', 'mercator', 'orthographic', 'natural earth', 'kavrayskiy7', 'miller', 'robinson', 'eckert4', 'azimuthal equal area', 'azimuthal equidistant', 'conic equal area', 'conic conformal', 'conic equidistant', 'gnomonic', 'stereographic', 'mollweide', 'hammer', 'transverse mercator', 'albers usa', 'winkel tripel', 'aitoff', 'sinusoidal']
 #projections_sub = ['equirectangular', 'natural earth', 'eckert4', 'mollweide', 'albers usa', 'sinusoidal']
 projections = ['natural earth']
-            
-for j in range(len(projections)):
-
-    for i in range(len(datelist)):
-
-        date = datelist[i]
-    
-        fig = go.Figure(data=[
-    
-        go.Choropleth(
-        locations = df['country_id'][usa],
-        text = df['country_name'][usa],
-        z = df[date][usa],
-        zmin = 0, 
-        zmax = nlabels,
-        locationmode='USA-states',
-        colorscale = colorscale,
-        colorbar = dict(thickness=15, tickvals=tickvals, ticktext=ticktext),
-        reversescale=False,
-        marker_line_color='darkgray',
-        marker_line_width=0.5,
-        colorbar_tickprefix = '',    
-        colorbar_title = 'Level'),
-                    
-        go.Choropleth(
-        locations = df['country_id'][world],
-        text = df['country_name'][world],
-        z = df[date][world],
-        zmin = 0, 
-        zmax = nlabels,
-        locationmode='ISO-3',   
-        colorscale = colorscale,
-        colorbar = dict(thickness=15, tickvals=tickvals, ticktext=ticktext),
-        reversescale=False,
-        marker_line_color='darkgray',
-        marker_line_width=0.5,
-        colorbar_tickprefix = '',
-        colorbar_title = 'Level')])
-
-        fig.update_layout(
-
-        title={
-            'text': 'Coronavirus counter-measures: ' + date,
-            'x':0.46,
-            'y':0.9,
-            'xanchor': 'center',
-            'yanchor': 'top'
-        },
-        geo=dict(
-            scope = 'world',
-            showframe = True,
-            showcoastlines = True,
-            projection_type = projections[j]
-        ),
-        annotations = [dict(
-            text = 'Data: <a href="https://github.com/OlivierLej/Coronavirus_CounterMeasures">Olivier Lejeune</a>, Visualisation: <a href="https://patternizer.github.io">Michael Taylor</a>',
-            x = 0.5, 
-            y=  0.0, 
-            xanchor = 'center',
-            yanchor = 'bottom',
-            showarrow = False,
-            )
-        ],
-        margin=dict(r=0, l=0, b=40, t=40), 
-        )
-
-        fig.write_image('countermeasures_'+ date +'.png')
+
+# Frames whose hash in the manifest matches are not re-rendered
+manifest_file = 'countermeasures_frames.json'
+
+#-----------------------------------------------------------------------
+def make_frame(date, projection):
+    """
+    date - 'YYYY-MM-DD'
+    projection - plotly geo projection_type
+    returns - plotly figure dict of the world status on date, from the
+    shared map template in its video style
+    """
+
+    return map_figure(current_dataset(), date, colormap, projection, style='video')
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def frame_filename(date):
+    """
+    date - 'YYYY-MM-DD'
+    returns - PNG filename of the frame for date
+    """
+
+    return 'countermeasures_'+ date +'.png'
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+@lru_cache(maxsize=None)
+def settings_hash(projection):
+    """
+    projection - plotly geo projection_type
+    returns - sha1 of the frame figure JSON without its per-date z arrays and
+    title: covers the locations, colorscale, projection and layout settings
+    """
+
+    spec = map_template(current_dataset(), colormap, projection, 'video')
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def frame_hash(date, projection):
+    """
+    date - 'YYYY-MM-DD'
+    projection - plotly geo projection_type
+    returns - content hash of the frame: the day's level column plus settings_hash()
+    """
+
+    h = hashlib.sha1(settings_hash(projection).encode('utf-8'))
+    h.update(date.encode('utf-8'))
+    h.update(current_dataset().column(date).tobytes())
+    return h.hexdigest()
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def load_manifest():
+    """
+    returns - dict of frame filename --> frame_hash() of the rendered PNG
+    """
+
+    if not os.path.exists(manifest_file):
+        return {}
+    with open(manifest_file) as f:
+        return json.load(f)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def save_manifest(manifest):
+    """
+    manifest - dict of frame filename --> frame_hash()
+    """
+
+    atomic_write(manifest_file, json.dumps(manifest, indent=0, sort_keys=True).encode('utf-8'))
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def stale_frames(dates, projection, manifest):
+    """
+    dates - list of 'YYYY-MM-DD'
+    projection - plotly geo projection_type
+    manifest - dict of frame filename --> frame_hash()
+    returns - dict of date --> frame_hash() for the dates whose PNG is missing
+    or was rendered from different data or settings
+    """
+
+    stale = {}
+    for date in dates:
+        filename = frame_filename(date)
+        h = frame_hash(date, projection)
+        if manifest.get(filename) != h or not os.path.exists(filename):
+            stale[date] = h
+    return stale
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def init_worker():
+    """
+    Process pool initializer: export a blank figure so the image-export
+    engine is started once per worker rather than on its first frame.
+    """
+
+    pio.to_image(go.Figure(), format='png')
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def render_frame(task):
+    """
+    task - (date, projection)
+    returns - filename of the rendered PNG frame
+    """
+
+    date, projection = task
+    filename = frame_filename(date)
+    pio.write_image(make_frame(date, projection), filename, validate=False)
+    return filename
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def render_image(task):
+    """
+    task - (date, projection)
+    returns - PNG bytes of the frame, without writing it to disk
+    """
+
+    date, projection = task
+    return pio.to_image(make_frame(date, projection), format='png', validate=False)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def render_images(dates, projection, workers=1):
+    """
+    dates - list of 'YYYY-MM-DD'
+    projection - plotly geo projection_type
+    workers - number of rendering processes (1 = render in this process)
+    returns - generator of PNG bytes in date order; at most 2 x workers
+    frames are in flight so memory stays bounded
+    """
+
+    tasks = [(date, projection) for date in dates]
+    return bounded_map(render_image, tasks, min(workers, len(tasks)), init_worker)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def render_frames(dates, projection, workers=1):
+    """
+    dates - list of 'YYYY-MM-DD'
+    projection - plotly geo projection_type
+    workers - number of rendering processes (1 = render in this process)
+    returns - list of frame filenames in date order
+    """
+
+    tasks = [(date, projection) for date in dates]
+    if workers <= 1 or len(tasks) <= 1:
+        return [render_frame(task) for task in tasks]
+
+    workers = min(workers, len(tasks))
+    chunksize = max(1, len(tasks) // (4 * workers))
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        return list(executor.map(render_frame, tasks, chunksize=chunksize))
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def animation_filename(projection, fmt):
+    """
+    projection - plotly geo projection_type
+    fmt - 'gif' or 'mp4'
+    returns - filename of the animation
+    """
+
+    return "countermeasures_" + projection + "." + fmt
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def make_gif(projection, fmt='gif', delta=False):
+    """
+    projection - plotly geo projection_type (used in the output filename)
+    fmt - 'gif' or 'mp4'
+    delta - GIF only: store just the pixels that changed since the previous day
+    Streams all countermeasures_*.png frames into an animated loop, one
+    frame in memory at a time.
+    """
 
     fp_in = "countermeasures_*.png"
-    fp_out = "countermeasures_" + projections[j] + ".gif"
+    fp_out = animation_filename(projection, fmt)
+
+    encode(iter_png_frames(fp_in), fp_out, duration=200, loop=0, delta=delta)
+#-----------------------------------------------------------------------
+
+#-----------------------------------------------------------------------
+def main():
 
-    img, *imgs = [Image.open(f) for f in sorted(glob.glob(fp_in))]
-    img.save(fp=fp_out, format='GIF', append_images=imgs,
-         save_all=True, duration=200, loop=0)
+    parser = argparse.ArgumentParser(description='Render daily countermeasures maps and an animated GIF loop')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='number of rendering processes (0 = one per CPU core, default 1)')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='re-render every frame, ignoring ' + manifest_file)
+    parser.add_argument('--format', choices=['gif', 'mp4'], default='gif',
+                        help='animation format (default gif)')
+    parser.add_argument('--direct', action='store_true',
+                        help='stream rendered frames straight into the encoder without writing PNG files')
+    parser.add_argument('--backend', choices=['plotly', 'raster'], default='plotly',
+                        help='plotly image export, or the native label-image renderer (implies --direct)')
+    parser.add_argument('--geometry', default=None,
+                        help='TopoJSON / GeoJSON outlines for the raster backend (default: plotly world_110m.json)')
+    parser.add_argument('--delta', action='store_true',
+                        help='GIF only: write just the changed rectangle of each frame and merge identical days')
+    args = parser.parse_args()
+    workers = args.workers if args.workers > 0 else (os.cpu_count() or 1)
 
-#-----------------------------------------------------------------------------------------------
+    dataset = current_dataset()
+    datelist = frame_dates()
+    manifest = {} if args.force else load_manifest()
+    for j in range(len(projections)):
 
-print('** END')
+        if args.backend == 'raster':
+            renderer = RasterRenderer(dataset, colors, projections[j], load_geometry(args.geometry))
+            frames = (renderer.render(date) for date in datelist)
+            encode(frames, animation_filename(projections[j], args.format), duration=200, loop=0, delta=args.delta)
+            continue
 
+        if args.direct:
+            frames = iter_image_bytes(render_images(datelist, projections[j], workers))
+            encode(frames, animation_filename(projections[j], args.format), duration=200, loop=0, delta=args.delta)
+            continue
+
+        stale = stale_frames(datelist, projections[j], manifest)
+        print('** rendering ' + str(len(stale)) + ' of ' + str(len(datelist)) + ' frames')
+        dates = list(stale)
+        for date, filename in zip(dates, render_frames(dates, projections[j], workers)):
+            manifest[filename] = stale[date]
+        save_manifest(manifest)
+        make_gif(projections[j], args.format, args.delta)
+
+    print('** END')
+#-----------------------------------------------------------------------
 
+if __name__ == "__main__":
+    main()